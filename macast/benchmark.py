@@ -0,0 +1,149 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Startup benchmark
+# Measure how long Macast takes to become reachable, with a headless renderer
+# in a fresh interpreter each run:
+#   python -m macast.benchmark [--runs 3] [--top 15]
+# Reported (seconds, median of runs):
+#   import       import macast
+#   http_bound   HTTP server is listening
+#   ssdp_alive   first SSDP alive notification is sent
+# and the heaviest packages from python -X importtime.
+# The exit code is 1 if any median exceeds BUDGET, so it can be used to catch
+# regressions. Settings are written to a temporary config dir on linux.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+# seconds, measured on a low end machine, raise them with care
+BUDGET = {
+    'import': 1.5,
+    'http_bound': 2.5,
+    'ssdp_alive': 3.0,
+}
+CHILD_TIMEOUT = 30
+
+CHILD_CODE = """
+import time
+start = time.perf_counter()
+from macast.benchmark import child
+child(start)
+"""
+
+
+def child(start):
+    """Run in the measured interpreter, print marks as json
+    :param start: time.perf_counter() before importing macast
+    """
+    marks = {'import': time.perf_counter() - start}
+    import cherrypy
+    from macast import Service
+    from macast.protocol import DLNAProtocol
+    from macast_renderer.null import NullRenderer
+
+    def on_ssdp_alive():
+        marks.setdefault('ssdp_alive', time.perf_counter() - start)
+
+    cherrypy.engine.subscribe('ssdp_alive', on_ssdp_alive)
+    service = Service(NullRenderer(), DLNAProtocol())
+    marks['service_created'] = time.perf_counter() - start
+    service.run_async()
+    deadline = time.monotonic() + CHILD_TIMEOUT
+    while time.monotonic() < deadline:
+        if 'http_bound' not in marks and cherrypy.engine.state == cherrypy.engine.states.STARTED:
+            marks['http_bound'] = time.perf_counter() - start
+        if 'http_bound' in marks and 'ssdp_alive' in marks:
+            break
+        time.sleep(0.005)
+    print(json.dumps(marks))
+    sys.stdout.flush()
+    service.stop()
+
+
+def get_env(config_dir):
+    env = dict(os.environ)
+    env['XDG_CONFIG_HOME'] = config_dir
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    return env
+
+
+def measure_startup(env):
+    res = subprocess.run([sys.executable, '-c', CHILD_CODE], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         timeout=CHILD_TIMEOUT * 2)
+    for line in reversed(res.stdout.decode(errors='replace').splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    raise RuntimeError('startup failed, exit code: {}'.format(res.returncode))
+
+
+def measure_import_time(env, top):
+    """Cumulative import time (seconds) of top level packages, by python -X importtime
+    """
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import macast'], env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                         timeout=CHILD_TIMEOUT)
+    packages = {}
+    for line in res.stderr.decode(errors='replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_time = int(fields[0])
+        except ValueError:
+            continue
+        name = fields[2].strip().split('.')[0]
+        packages[name] = packages.get(name, 0) + self_time / 1e6
+    return sorted(packages.items(), key=lambda i: i[1], reverse=True)[:top]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark startup time of Macast')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15, help='number of heaviest packages to show')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        env = get_env(config_dir)
+        runs = [measure_startup(env) for _ in range(args.runs)]
+        packages = measure_import_time(env, args.top)
+
+    print('{:<16}{:>10}{:>10}'.format('stage', 'median', 'budget'))
+    exceeded = []
+    for name in ['import', 'service_created', 'http_bound', 'ssdp_alive']:
+        values = [i[name] for i in runs if name in i]
+        if len(values) == 0:
+            print('{:<16}{:>10}'.format(name, 'missing'))
+            if name in BUDGET:
+                exceeded.append(name)
+            continue
+        value = median(values)
+        budget = BUDGET.get(name, None)
+        print('{:<16}{:>10.3f}{:>10}'.format(name, value, '' if budget is None else budget))
+        if budget is not None and value > budget:
+            exceeded.append(name)
+    if packages:
+        print('\nheaviest packages (self time of all modules, seconds)')
+        for name, value in packages:
+            print('{:<24}{:>8.3f}'.format(name, value))
+    if exceeded:
+        print('\nover budget: {}'.format(', '.join(exceeded)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Bus benchmark
+# Measure the cost of finding the protocol and the renderer through the
+# cherrypy bus on the hot paths, with and without BusCache:
+#   python -m macast.benchmark_bus [--number 20000]
+# Reported (microseconds per call):
+#   protocol.renderer          Protocol.renderer, used by every SOAP action
+#   renderer.protocol          Renderer.protocol, used by every mpv event
+#   set_state_position         an mpv position event passed to the protocol
+#   call GetPositionInfo       one DLNAProtocol.call, polled by DLNA clients
+# "uncached" publishes on the bus at every access, which is the behaviour
+# before BusCache, "cached" is the current one.
+
+import sys
+import timeit
+import argparse
+import contextlib
+
+import cherrypy
+
+from .utils import BusCache, cherrypy_publish
+from .plugin import RendererPlugin, ProtocolPlugin
+from .protocol import DLNAProtocol
+from macast_renderer.null import NullRenderer
+
+SOAP_GET_POSITION_INFO = b'''<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"
+s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+<s:Body><u:GetPositionInfo xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
+<InstanceID>0</InstanceID></u:GetPositionInfo></s:Body></s:Envelope>'''
+
+
+@contextlib.contextmanager
+def uncached():
+    """Publish on the bus at every access, as it was before BusCache
+    """
+    get = BusCache.get
+    BusCache.get = lambda self: cherrypy_publish(self.channel)
+    try:
+        yield
+    finally:
+        BusCache.get = get
+
+
+def measure(func, number):
+    """
+    :return: microseconds per call, best of 3
+    """
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark protocol and renderer lookup through the bus')
+    parser.add_argument('--number', type=int, default=20000, help='calls of each case')
+    args = parser.parse_args()
+
+    renderer = NullRenderer()
+    protocol = DLNAProtocol()
+    # subscribe the same channels as a running Macast, without starting the engine
+    renderer_plugin = RendererPlugin(cherrypy.engine, renderer)
+    protocol_plugin = ProtocolPlugin(cherrypy.engine, protocol)
+    renderer_plugin.start()
+    protocol_plugin.start()
+
+    cases = [
+        ('protocol.renderer', lambda: protocol.renderer, args.number),
+        ('renderer.protocol', lambda: renderer.protocol, args.number),
+        ('set_state_position', lambda: renderer.set_state_position('00:00:01'), args.number),
+        ('call GetPositionInfo', lambda: protocol.call(SOAP_GET_POSITION_INFO), args.number // 10),
+    ]
+    print('{:<24}{:>12}{:>12}{:>10}'.format('case', 'uncached', 'cached', 'speedup'))
+    try:
+        for name, func, number in cases:
+            with uncached():
+                before = measure(func, number)
+            after = measure(func, number)
+            print('{:<24}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(name, before, after, before / after))
+    finally:
+        protocol_plugin.stop()
+        renderer_plugin.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
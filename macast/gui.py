@@ -6,12 +6,9 @@ import subprocess
 from enum import Enum
 from .utils import Setting
 
+# pystray and PIL are imported when the tray icon is built, see also: App.__init__
 if sys.platform == 'darwin':
     import rumps
-else:
-    import pystray
-    import webbrowser
-    from PIL import Image
 
 logger = logging.getLogger("gui")
 logger.setLevel(logging.INFO)
@@ -118,6 +115,8 @@ class App:
                                  quit_button=None)
             rumps.debug_mode(True)
         else:
+            import pystray
+            from PIL import Image
             self.app = pystray.Icon(self.name,
                                     Image.open(self.icon),
                                     menu=pystray.Menu(
@@ -153,6 +152,7 @@ class App:
         return menu_item
 
     def _build_menu_pystray(self, menu):
+        import pystray
         items = []
         for item in menu:
             if item is None:
@@ -179,6 +179,7 @@ class App:
             self.app.template = template
             self.app.icon = self.icon
         else:
+            from PIL import Image
             self.app.icon = Image.open(self.icon)
 
     def update_menu(self):
@@ -194,6 +195,7 @@ class App:
             self.app.menu.clear()
             self.app.menu = self._build_menu_rumps(menu)
         else:
+            import pystray
             self.app.menu = pystray.Menu(lambda: self._build_menu_pystray(menu))
 
     def _find_menu_item_index_by_id(self, id):
@@ -296,6 +298,7 @@ class App:
         if self.platform == Platform.Darwin:
             subprocess.Popen(['open', url])
         elif self.platform == Platform.Win32:
+            import webbrowser
             webbrowser.open(url)
         else:
             subprocess.Popen(["xdg-open", url], env=self.get_env())
@@ -0,0 +1,161 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Plugin installer
+# Plugins are downloaded by a background thread, written in chunks to a
+# temporary file next to the target, optionally checked against a SHA-256
+# digest, and moved in place with an atomic rename.
+# The installed plugin is announced through the cherrypy bus, so it can be
+# loaded without restarting Macast:
+#   cherrypy.engine.publish('install_plugin', plugin_type, url, sha256)
+#   cherrypy.engine.publish('get_plugin_install_info')
+#   cherrypy.engine.subscribe('plugin_installed', callback(plugin_type, path))
+
+import os
+import re
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import cherrypy
+
+from .utils import SETTING_DIR, RENDERER_DIR, PROTOCOL_DIR
+
+logger = logging.getLogger("Installer")
+logger.setLevel(logging.INFO)
+
+PLUGIN_DIRS = {
+    'renderer': RENDERER_DIR,
+    'protocol': PROTOCOL_DIR,
+}
+CHUNK_SIZE = 64 * 1024
+# plugins are single python files, anything larger is refused
+MAX_PLUGIN_SIZE = 16 * 1024 * 1024
+# (connect, read) timeout in seconds
+DOWNLOAD_TIMEOUT = (10, 30)
+
+
+class InstallError(Exception):
+    pass
+
+
+class PluginInstaller:
+    """Install one plugin at a time, see also: macast.py -> class MacastPluginManager
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = 'idle'  # idle, downloading, installing, done, error
+        self.url = ''
+        self.path = ''
+        self.downloaded = 0
+        self.total = 0
+        self.message = ''
+        self.start_time = 0
+
+    @staticmethod
+    def get_plugin_path(plugin_type, url):
+        """Check plugin type and file name from url
+        :return: local path of plugin
+        """
+        if plugin_type not in PLUGIN_DIRS:
+            raise InstallError('unknown plugin type: {}'.format(plugin_type))
+        name = url.split('?')[0].split('/')[-1]
+        # file name is used as the module name of plugin
+        if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*\.py', name) is None or name == '__init__.py':
+            raise InstallError('invalid plugin file name: {}'.format(name))
+        return os.path.join(SETTING_DIR, PLUGIN_DIRS[plugin_type], name)
+
+    def install(self, plugin_type, url, sha256=None):
+        """Start installing a plugin in background
+        :param plugin_type: renderer or protocol
+        :param url: url of plugin file
+        :param sha256: hex digest of plugin file, not checked if None
+        :return: (success, message)
+        """
+        try:
+            path = self.get_plugin_path(plugin_type, url)
+        except InstallError as e:
+            return False, str(e)
+        with self.lock:
+            if self.state in ['downloading', 'installing']:
+                return False, 'Downloading other plugin now'
+            self.state = 'downloading'
+            self.url = url
+            self.path = path
+            self.downloaded = 0
+            self.total = 0
+            self.message = ''
+            self.start_time = time.time()
+        threading.Thread(target=self.run,
+                         args=(plugin_type, url, path, sha256),
+                         daemon=True,
+                         name="PLUGIN_INSTALL_THREAD").start()
+        return True, 'installing plugin'
+
+    def run(self, plugin_type, url, path, sha256):
+        try:
+            self.download(url, path, sha256)
+        except Exception as e:
+            logger.error("install plugin error: {}".format(e))
+            with self.lock:
+                self.state = 'error'
+                self.message = str(e)
+            cherrypy.engine.publish('app_notify', 'ERROR', 'Install plugin error: {}'.format(e))
+            return
+        logger.info("plugin installed: {}".format(path))
+        cherrypy.engine.publish('plugin_installed', plugin_type, path)
+        with self.lock:
+            self.state = 'done'
+        cherrypy.engine.publish('app_notify', 'INFO', 'Plugin installed: {}'.format(os.path.basename(path)))
+
+    def download(self, url, path, sha256):
+        """Download url to path, the file at path is replaced only when everything is right
+        """
+        import requests
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as res:
+                    res.raise_for_status()
+                    total = int(res.headers.get('Content-Length', 0) or 0)
+                    if total > MAX_PLUGIN_SIZE:
+                        raise InstallError('plugin is too large: {} bytes'.format(total))
+                    with self.lock:
+                        self.total = total
+                    for chunk in res.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        with self.lock:
+                            self.downloaded += len(chunk)
+                            if self.downloaded > MAX_PLUGIN_SIZE:
+                                raise InstallError('plugin is too large')
+                with self.lock:
+                    self.state = 'installing'
+                if sha256 and digest.hexdigest() != sha256.lower():
+                    raise InstallError('sha256 mismatch: {}'.format(digest.hexdigest()))
+                f.flush()
+                os.fsync(f.fileno())
+            with open(temp_path, 'r', encoding='utf-8') as f:
+                if re.search("<macast.(renderer|protocol)>", f.read()) is None:
+                    raise InstallError('not a Macast plugin')
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def get_info(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'url': self.url,
+                'name': os.path.basename(self.path),
+                'downloaded': self.downloaded,
+                'total': self.total,
+                'message': self.message,
+                'start_time': self.start_time,
+            }
@@ -0,0 +1,303 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Log file
+# Writing: records of all loggers are put to a queue by the calling thread
+# without formatting, a listener thread formats and writes them to macast.log,
+# which is rotated by size. Repeated records below WARNING are sampled.
+#   setup_logging, get_log_levels, set_log_level
+# Reading: parts of macast.log without loading the whole file:
+#   read_range: bytes from an offset
+#   read_tail:  last N lines, found by reading blocks backward from the end
+#   follow:     server-sent events of new content, resumed by the file position
+# Memory used by each request is bounded by READ_LIMIT, whatever the log size is.
+
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+import cherrypy
+
+from .utils import SETTING_DIR
+
+logger = logging.getLogger("LogFile")
+logger.setLevel(logging.INFO)
+
+LOG_PATH = os.path.join(SETTING_DIR, 'macast.log')
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+# records from one line of code below WARNING, at most SAMPLE_RATE per SAMPLE_INTERVAL seconds
+SAMPLE_RATE = 20
+SAMPLE_INTERVAL = 1
+# max bytes returned by one request or one event
+READ_LIMIT = 256 * 1024
+BLOCK_SIZE = 8192
+DEFAULT_TAIL_LINES = 500
+# seconds between checks of the file size in follow mode
+FOLLOW_INTERVAL = 0.5
+# an idle comment is sent to keep the connection alive
+FOLLOW_KEEPALIVE = 15
+# a follower holds a server thread, the stream ends after this time
+# and the browser reconnects with Last-Event-ID, so open log pages
+# cannot keep the thread pool busy for long
+FOLLOW_TIMEOUT = 25
+
+
+class SamplingFilter(logging.Filter):
+    """Drop records beyond the rate of a logger, counted by the line of code
+    which logs them, records of WARNING and above are always kept
+    """
+
+    def __init__(self, rate=SAMPLE_RATE, interval=SAMPLE_INTERVAL):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.rates = {}  # logger name -> rate, 0 means no limit
+        self.interval = interval
+        self.counters = {}  # (logger name, path, line) -> [start of interval, count, dropped]
+        self.lock = threading.Lock()
+
+    def get_rate(self, name):
+        return self.rates.get(name, self.rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.get_rate(record.name)
+        if rate <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        with self.lock:
+            counter = self.counters.get(key, None)
+            if counter is None or record.created - counter[0] >= self.interval:
+                self.counters[key] = [record.created, 1, 0]
+                record.dropped = 0 if counter is None else counter[2]
+                return True
+            if counter[1] < rate:
+                counter[1] += 1
+                return True
+            counter[2] += 1
+            return False
+
+
+class SampledFormatter(logging.Formatter):
+
+    def format(self, record):
+        res = super(SampledFormatter, self).format(record)
+        dropped = getattr(record, 'dropped', 0)
+        if dropped:
+            res += ' ({} similar records dropped)'.format(dropped)
+        return res
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Put records to queue as they are, the message is formatted by the listener thread
+    QueueHandler formats the message in the calling thread, which is what we want to avoid.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+sampling_filter = SamplingFilter()
+_listener = None
+_queue_handler = None
+_listener_lock = threading.Lock()
+
+
+def setup_logging():
+    """Send records of all loggers (including cherrypy) to macast.log through a queue,
+    it is safe to be called more than once
+    """
+    global _listener, _queue_handler
+    with _listener_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(-1)
+        formatter = SampledFormatter(LOG_FORMAT)
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8', delay=True)
+        file_handler.setFormatter(formatter)
+        handlers = [file_handler]
+        if sys.stderr is not None:
+            # running from source
+            console_handler = logging.StreamHandler()
+            console_handler.setLevel(logging.WARNING)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        _queue_handler = DeferredQueueHandler(log_queue)
+        _queue_handler.addFilter(sampling_filter)
+        logging.getLogger().addHandler(_queue_handler)
+    # cherrypy logs to its own handlers by default
+    cherrypy.log.screen = False
+    cherrypy.log.error_log.propagate = True
+    cherrypy.log.access_log.propagate = True
+
+
+def stop_logging():
+    """Write the remaining records and stop the listener thread
+    """
+    global _listener, _queue_handler
+    with _listener_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _listener.stop()
+            _listener = None
+            _queue_handler = None
+
+
+def get_log_levels():
+    """Level and sample rate of each logger
+    """
+    res = {}
+    for name, item in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(item, logging.Logger):
+            res[name] = {
+                'level': logging.getLevelName(item.getEffectiveLevel()),
+                'sample_rate': sampling_filter.get_rate(name),
+            }
+    return res
+
+
+def set_log_level(name, level=None, sample_rate=None):
+    """Change level or sample rate of a logger at runtime
+    :param name: name of an existing logger
+    :param level: eg: DEBUG, INFO
+    :param sample_rate: records per second of one line of code, 0 means no limit
+    :return: True if success
+    """
+    if not isinstance(logging.root.manager.loggerDict.get(name, None), logging.Logger):
+        return False
+    if level is not None:
+        level = logging.getLevelName(str(level).upper())
+        if not isinstance(level, int):
+            return False
+    if sample_rate is not None:
+        sample_rate = int(sample_rate)
+    if level is not None:
+        logging.getLogger(name).setLevel(level)
+    if sample_rate is not None:
+        sampling_filter.rates[name] = sample_rate
+    logger.info("set logger %s: level %s, sample rate %s",
+                name, logging.getLevelName(logging.getLogger(name).level), sampling_filter.get_rate(name))
+    return True
+
+
+def get_size(path=LOG_PATH):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def decode(data: bytes):
+    return data.decode('utf-8', errors='replace')
+
+
+def read_bytes(offset, limit, path=LOG_PATH):
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(limit)
+    except OSError as e:
+        logger.error("read log error: {}".format(e))
+        return b''
+
+
+def read_range(offset=0, limit=READ_LIMIT, path=LOG_PATH):
+    """Read bytes of log from offset
+    :param offset: start position, negative value counts from the end of file
+    :param limit: max bytes, no more than READ_LIMIT
+    :return: {'logs': text, 'offset': start, 'end': end, 'size': file size}
+    """
+    size = get_size(path)
+    if offset < 0:
+        offset = max(size + offset, 0)
+    offset = min(offset, size)
+    limit = max(min(limit, READ_LIMIT), 0)
+    data = read_bytes(offset, limit, path) if limit > 0 and offset < size else b''
+    return {'logs': decode(data), 'offset': offset, 'end': offset + len(data), 'size': size}
+
+
+def read_tail(lines=DEFAULT_TAIL_LINES, path=LOG_PATH):
+    """Read the last lines of log
+    Blocks are read backward from the end until enough line breaks are found,
+    so only the tail of the file is touched.
+    :param lines: number of lines
+    :return: same as read_range
+    """
+    lines = max(lines, 1)
+    size = get_size(path)
+    start = size
+    blocks = []
+    count = 0
+    try:
+        with open(path, 'rb') as f:
+            while start > 0 and count <= lines and size - start < READ_LIMIT:
+                length = min(BLOCK_SIZE, start)
+                start -= length
+                f.seek(start)
+                block = f.read(length)
+                blocks.insert(0, block)
+                count += block.count(b'\n')
+    except OSError as e:
+        logger.error("read log error: {}".format(e))
+        return {'logs': '', 'offset': size, 'end': size, 'size': size}
+    data = b''.join(blocks)
+    # the last line break closes the last line, it is not counted
+    index = len(data) - 1 if data.endswith(b'\n') else len(data)
+    for _ in range(lines):
+        index = data.rfind(b'\n', 0, index)
+        if index < 0:
+            break
+    if index >= 0:
+        data = data[index + 1:]
+        start += index + 1
+    if len(data) > READ_LIMIT:
+        start += len(data) - READ_LIMIT
+        data = data[-READ_LIMIT:]
+    return {'logs': decode(data), 'offset': start, 'end': start + len(data), 'size': size}
+
+
+def format_event(text, event_id):
+    """Format a server-sent event, every line of text is a data field
+    """
+    data = ''.join('data: {}\n'.format(line) for line in text.split('\n'))
+    return 'id: {}\n{}\n'.format(event_id, data).encode()
+
+
+def follow(offset=None, path=LOG_PATH):
+    """Server-sent events of content appended to log
+    :param offset: start position, the end of file if None
+    :return: generator of event stream
+    """
+    position = get_size(path) if offset is None else offset
+    deadline = time.monotonic() + FOLLOW_TIMEOUT
+    last_send = time.monotonic()
+    yield 'retry: 1000\n\n'.encode()
+    while cherrypy.engine.state == cherrypy.engine.states.STARTED and time.monotonic() < deadline:
+        size = get_size(path)
+        if size < position:
+            # log is truncated or rotated
+            position = 0
+        if size > position:
+            data = read_bytes(position, READ_LIMIT, path)
+            # a partial line is sent with the next event, unless it fills the limit
+            if len(data) < READ_LIMIT:
+                data = data[:data.rfind(b'\n') + 1]
+            if data:
+                position += len(data)
+                last_send = time.monotonic()
+                yield format_event(decode(data).rstrip('\n'), position)
+                continue
+        if time.monotonic() - last_send > FOLLOW_KEEPALIVE:
+            last_send = time.monotonic()
+            yield b': keepalive\n\n'
+        time.sleep(FOLLOW_INTERVAL)
@@ -8,8 +8,6 @@ import json
 import cherrypy
 import logging
 import threading
-import requests
-import pyperclip
 import gettext
 import importlib
 
@@ -25,9 +23,68 @@ logger.setLevel(logging.DEBUG)
 _ = gettext.gettext
 
 
+PLUGIN_MANIFEST = 'plugin_manifest.json'
+
+
+class PluginManifest:
+    """Metadata of plugin files, validated by modification time and size,
+    so that a plugin file is read only when it is new or changed
+    """
+
+    def __init__(self, path=os.path.join(SETTING_DIR, PLUGIN_MANIFEST)):
+        self.path = path
+        self.entries = {}  # plugin path -> {'mtime', 'size', 'metadata'}
+        self.changed = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get_metadata(self, path):
+        """Read <macast.*> metadata of plugin file
+        :return: dict, eg: {'title': 'IINA', 'renderer': 'IINARenderer', ...}
+        """
+        stat = os.stat(path)
+        entry = self.entries.get(path, None)
+        if entry is not None and entry.get('mtime', None) == stat.st_mtime_ns \
+                and entry.get('size', None) == stat.st_size:
+            return entry['metadata']
+        with open(path, 'r', encoding='utf-8') as f:
+            metadata = dict(re.findall("<macast.(.*?)>(.*?)</macast", f.read()))
+        logger.info("scan plugin: {} {}".format(os.path.basename(path), metadata))
+        self.entries[path] = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'metadata': metadata
+        }
+        self.changed = True
+        return metadata
+
+    def prune(self, paths):
+        """Remove plugins which are not in paths
+        """
+        for path in list(self.entries.keys()):
+            if path not in paths:
+                del self.entries[path]
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(temp_path, self.path)
+            self.changed = False
+        except OSError as e:
+            logger.error("save plugin manifest error: {}".format(e))
+
+
 class MacastPlugin:
 
-    def __init__(self, path, title="None", plugin_instance=None, platform='none'):
+    def __init__(self, path, title="None", plugin_instance=None, platform='none', manifest=None):
         # path is allowed to be set to None only when renderer is macast default plugin
         self.path = path
         self.title = title
@@ -36,7 +93,7 @@ class MacastPlugin:
         self.platform = platform
         if path:
             try:
-                self.load_from_file(path)
+                self.load_from_file(path, manifest)
             except Exception as e:
                 cherrypy.engine.publish('app_notify', 'ERROR', 'Custom plugin load error.')
                 logger.error(str(e))
@@ -57,7 +114,7 @@ class MacastPlugin:
         return res
 
     def get_instance(self):
-        if self.plugin_instance is None and self.plugin_class is not None:
+        if self.plugin_instance is None and self.load_class() is not None:
             self.plugin_instance = self.plugin_class()
 
         return self.plugin_instance
@@ -65,7 +122,10 @@ class MacastPlugin:
     def check(self):
         """ Check if this renderer can run on your device
         """
-        if self.plugin_class is None:
+        if self.path is None:
+            return self.plugin_instance is not None
+        if not hasattr(self, 'renderer') and not hasattr(self, 'protocol'):
+            logger.error("Cannot find any plugin in {}".format(self.path))
             return False
         if sys.platform in self.platform:
             return True
@@ -74,26 +134,41 @@ class MacastPlugin:
         logger.error("{} is not suit for this system.".format(self.title))
         return False
 
-    def load_from_file(self, path):
-        base_name = os.path.basename(path)[:-3]
-        with open(path, 'r', encoding='utf-8') as f:
-            renderer_file = f.read()
-            metadata = re.findall("<macast.(.*?)>(.*?)</macast", renderer_file)
-            print("<Load Plugin from {}".format(base_name))
-            for key, value in metadata:
-                print('%-10s: %s' % (key, value))
-                setattr(self, key, str(value))
-        if hasattr(self, 'renderer'):
-            module = importlib.import_module(f'{RENDERER_DIR}.{base_name}')
-            print(f'Load plugin {self.renderer} done />\n')
-            self.plugin_class = getattr(module, self.renderer, None)
-        elif hasattr(self, 'protocol'):
-            module = importlib.import_module(f'{PROTOCOL_DIR}.{base_name}')
-            print(f'Load plugin {self.protocol} done />\n')
-            self.plugin_class = getattr(module, self.protocol, None)
-        else:
-            logger.error(f"Cannot find any plugin in {base_name}")
-            return
+    @staticmethod
+    def import_module(name):
+        """Import plugin module, the module is reloaded if it has been imported,
+        so that an updated plugin file takes effect
+        """
+        if name in sys.modules:
+            return importlib.reload(sys.modules[name])
+        return importlib.import_module(name)
+
+    def load_from_file(self, path, manifest=None):
+        """Load metadata of plugin, the plugin module is imported by load_class
+        """
+        manifest = PluginManifest() if manifest is None else manifest
+        for key, value in manifest.get_metadata(path).items():
+            setattr(self, key, str(value))
+
+    def load_class(self):
+        """Import plugin module when the plugin is used for the first time
+        :return: plugin class or None
+        """
+        if self.plugin_class is not None or self.path is None:
+            return self.plugin_class
+        base_name = os.path.basename(self.path)[:-3]
+        try:
+            if hasattr(self, 'renderer'):
+                module = self.import_module(f'{RENDERER_DIR}.{base_name}')
+                self.plugin_class = getattr(module, self.renderer, None)
+            elif hasattr(self, 'protocol'):
+                module = self.import_module(f'{PROTOCOL_DIR}.{base_name}')
+                self.plugin_class = getattr(module, self.protocol, None)
+            print(f'Load plugin {self.title} from {base_name}: {self.plugin_class}')
+        except Exception as e:
+            cherrypy.engine.publish('app_notify', 'ERROR', 'Custom plugin load error.')
+            logger.error(str(e))
+        return self.plugin_class
 
 
 class MacastPluginManager:
@@ -102,20 +177,56 @@ class MacastPluginManager:
         sys.path.append(SETTING_DIR)
         self.create_plugin_dir(RENDERER_DIR)
         self.create_plugin_dir(PROTOCOL_DIR)
+        self.manifest = PluginManifest()
         self.renderer_list = [renderer_default]
-        self.renderer_list += self.load_macast_plugin(RENDERER_DIR)
+        self.renderer_list += self.load_macast_plugin(RENDERER_DIR, self.manifest)
         self.protocol_list = [protocol_default]
-        self.protocol_list += self.load_macast_plugin(PROTOCOL_DIR)
+        self.protocol_list += self.load_macast_plugin(PROTOCOL_DIR, self.manifest)
+        # plugins which are deleted
+        self.manifest.prune([p for p in self.manifest.entries if os.path.exists(p)])
+        self.manifest.save()
+
+    def get_plugin_instance(self, plugin_list, name):
+        """Instance of plugin selected by name, the default one is used
+        if the selected plugin cannot be imported
+        :return: (MacastPlugin, instance)
+        """
+        plugin = self.get_plugin_from_list(plugin_list, name)
+        instance = plugin.get_instance()
+        if instance is None:
+            plugin = plugin_list[0]
+            instance = plugin.get_instance()
+        return plugin, instance
 
     def get_renderer(self, name):
-        plugin = self.get_plugin_from_list(self.renderer_list, name)
+        plugin, instance = self.get_plugin_instance(self.renderer_list, name)
         Setting.set(SettingProperty.Macast_Renderer, plugin.title)
-        return plugin.get_instance()
+        return instance
 
     def get_protocol(self, name):
-        plugin = self.get_plugin_from_list(self.protocol_list, name)
+        plugin, instance = self.get_plugin_instance(self.protocol_list, name)
         Setting.set(SettingProperty.Macast_Protocol, plugin.title)
-        return plugin.get_instance()
+        return instance
+
+    def install_plugin(self, plugin_type, path):
+        """Load a plugin file which is newly installed, see also: installer.py
+        An older version of this plugin in list is replaced.
+        :return: MacastPlugin or None
+        """
+        plugin_list = self.renderer_list if plugin_type == 'renderer' else self.protocol_list
+        # the directory listing of plugin dir is cached by importlib
+        importlib.invalidate_caches()
+        plugin_config = MacastPlugin(path, manifest=self.manifest)
+        self.manifest.save()
+        if not plugin_config.check():
+            return None
+        for i, plugin in enumerate(plugin_list):
+            if plugin.path == path or (plugin.path is not None and plugin.title == plugin_config.title):
+                plugin_list[i] = plugin_config
+                break
+        else:
+            plugin_list.append(plugin_config)
+        return plugin_config
 
     def get_info(self):
         res = []
@@ -136,16 +247,16 @@ class MacastPluginManager:
             return plugin_list[0]
 
     @staticmethod
-    def load_macast_plugin(path: str):
+    def load_macast_plugin(path: str, manifest=None):
         plugin_path = os.path.join(SETTING_DIR, path)
         if not os.path.exists(plugin_path):
-            return
+            return []
         plugin_list = []
         plugins = os.listdir(plugin_path)
         plugins = filter(lambda s: s.endswith('.py') and s != '__init__.py', plugins)
         for plugin in plugins:
             path = os.path.join(plugin_path, plugin)
-            plugin_config = MacastPlugin(path)
+            plugin_config = MacastPlugin(path, manifest=manifest)
             if plugin_config.check():
                 plugin_list.append(plugin_config)
         return plugin_list
@@ -223,6 +334,7 @@ class Macast(App):
         cherrypy.engine.subscribe('renderer_av_uri', self.renderer_av_uri)
         cherrypy.engine.subscribe('ssdp_update_ip', self.update_service_ip)
         cherrypy.engine.subscribe('app_notify', self.notification)
+        cherrypy.engine.subscribe('plugin_installed', self.plugin_installed)
         self.start_cast()
         logger.debug("Macast APP started")
 
@@ -347,6 +459,7 @@ class Macast(App):
         release_url = 'https://github.com/xfangfang/Macast/releases/latest'
         api_url = 'https://api.github.com/repos/xfangfang/Macast/releases/latest'
         try:
+            import requests
             res = json.loads(requests.get(api_url).text)
             online_version = re.findall(r'(\d+\.*\d+)', res['tag_name'])[0]
 
@@ -420,40 +533,74 @@ class Macast(App):
     def renderer_start(self):
         pass
 
+    def plugin_installed(self, plugin_type, path):
+        """A plugin is installed from the setting page, it is added to menu,
+        and takes the place of the running one if it is an update of it.
+        """
+        logger.info("plugin_installed: {}".format(path))
+        plugin_config = self.plugin_manager.install_plugin(plugin_type, path)
+        if plugin_config is None:
+            return
+        if plugin_type == 'renderer' and plugin_config.title == self.setting_renderer:
+            self.switch_renderer(plugin_config)
+        elif plugin_type == 'protocol' and plugin_config.title == self.setting_protocol:
+            self.switch_protocol(plugin_config)
+        else:
+            self.setting_menuitem.children = self.build_setting_menu()
+            self.set_menu(self.menu)
+
+    def switch_protocol(self, protocol_config):
+        # plugins are imported when they are selected for the first time
+        protocol = protocol_config.get_instance()
+        if protocol is None:
+            return
+        self.stop_cast()
+        # todo 生成新的 uuid
+        self.service.protocol = protocol
+        Setting.set(SettingProperty.Macast_Protocol, protocol_config.title)
+        self.setting_protocol = protocol_config.title
+        self.setting_menuitem.children = self.build_setting_menu()
+        # reload menu
+        self.set_menu(self.menu)
+        self.start_cast()
+
+    def switch_renderer(self, renderer_config):
+        renderer = renderer_config.get_instance()
+        if renderer is None:
+            return
+        self.service.renderer = renderer
+        Setting.set(SettingProperty.Macast_Renderer, renderer_config.title)
+        self.setting_renderer = renderer_config.title
+        self.setting_menuitem.children = self.build_setting_menu()
+        # reload menu
+        self.set_menu(self.menu)
+
     def renderer_av_uri(self, uri):
         logger.info("renderer_av_uri: " + uri)
         if self.copy_menuitem is not None:
-            self.copy_menuitem.callback = lambda _: pyperclip.copy(uri)
+            self.copy_menuitem.callback = lambda _: self.copy_text(uri)
             return
         self.copy_menuitem = MenuItem(
             _("Copy Video URI"),
             key="c",
-            callback=lambda _: pyperclip.copy(uri))
+            callback=lambda _: self.copy_text(uri))
         self.append_menu_item_after(self.toggle_menuitem.id, self.copy_menuitem)
 
+    @staticmethod
+    def copy_text(text):
+        import pyperclip
+        pyperclip.copy(text)
+
     # The followings are the callback function of menu click
 
     def on_protocol_change_click(self, item):
         protocol_config = self.plugin_manager.protocol_list[item.data]
-        self.stop_cast()
-        # todo 生成新的 uuid
-        self.service.protocol = protocol_config.get_instance()
-        Setting.set(SettingProperty.Macast_Protocol, protocol_config.title)
-        self.setting_protocol = protocol_config.title
-        self.setting_menuitem.children = self.build_setting_menu()
-        # reload menu
-        self.set_menu(self.menu)
-        self.start_cast()
+        self.switch_protocol(protocol_config)
         cherrypy.engine.publish('app_notify', _('Info'), _('Change Protocol to {}.').format(protocol_config.title))
 
     def on_renderer_change_click(self, item):
         renderer_config = self.plugin_manager.renderer_list[item.data]
-        self.service.renderer = renderer_config.get_instance()
-        Setting.set(SettingProperty.Macast_Renderer, renderer_config.title)
-        self.setting_renderer = renderer_config.title
-        self.setting_menuitem.children = self.build_setting_menu()
-        # reload menu
-        self.set_menu(self.menu)
+        self.switch_renderer(renderer_config)
         cherrypy.engine.publish('app_notify', _('Info'), _('Change Renderer to {}.').format(renderer_config.title))
 
     def on_open_config_click(self, item):
@@ -9,7 +9,7 @@ import logging
 import threading
 
 from .ssdp import SSDPServer
-from .utils import Setting
+from .utils import Setting, BusCache
 
 logger = logging.getLogger("PLUGIN")
 
@@ -33,6 +33,7 @@ class RendererPlugin(plugins.SimplePlugin):
         self.bus.subscribe('set_renderer', self.set_renderer)
         for method in self.renderer.methods():
             self.bus.subscribe(method, getattr(self.renderer, method))
+        BusCache.invalidate('get_renderer')
 
     def stop(self):
         """Stop RenderPlugin
@@ -43,6 +44,7 @@ class RendererPlugin(plugins.SimplePlugin):
         self.bus.unsubscribe('set_renderer', self.set_renderer)
         for method in self.renderer.methods():
             self.bus.unsubscribe(method, getattr(self.renderer, method))
+        BusCache.invalidate('get_renderer')
         self.renderer.stop()
 
     def get_renderer(self):
@@ -79,6 +81,7 @@ class ProtocolPlugin(plugins.SimplePlugin):
         self.bus.subscribe('set_protocol', self.set_protocol)
         for method in self.protocol.methods():
             self.bus.subscribe(method, getattr(self.protocol, method))
+        BusCache.invalidate('get_protocol')
 
     def stop(self):
         """Stop ProtocolPlugin
@@ -89,6 +92,7 @@ class ProtocolPlugin(plugins.SimplePlugin):
         self.bus.unsubscribe('set_protocol', self.set_protocol)
         for method in self.protocol.methods():
             self.bus.unsubscribe(method, getattr(self.protocol, method))
+        BusCache.invalidate('get_protocol')
         self.protocol.stop()
 
     def get_protocol(self):
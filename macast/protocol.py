@@ -10,13 +10,14 @@ import logging
 import cherrypy
 import threading
 
-import requests
 from lxml import etree
 from queue import Queue
 from enum import Enum
 from cherrypy import _cpnative_server
 
-from .utils import load_xml, XMLPath, Setting, cherrypy_publish, SETTING_DIR
+from .utils import load_xml, XMLPath, Setting, cherrypy_publish, BusCache
+from .static import CachedDocument
+from . import logfile
 
 logger = logging.getLogger("Protocol")
 logger.setLevel(logging.INFO)
@@ -27,17 +28,29 @@ SERVICE_STATE_OBSERVED = {
                     'CurrentMediaDuration',
                     'CurrentTrackDuration',
                     'CurrentTrack',
-                    'NumberOfTracks'],
+                    'NumberOfTracks',
+                    'AVTransportURI',
+                    'CurrentTrackURI',
+                    'NextAVTransportURI'],
     "RenderingControl": ['Volume', 'Mute'],
     "ConnectionManager": ['A_ARG_TYPE_Direction',
                           'SinkProtocolInfo',
                           'CurrentConnectionIDs']
 }
 
+UPNP_METADATA_NS = 'urn:schemas-upnp-org:metadata-1-0/upnp/'
+# upnp:class item -> media class passed to renderer.set_media_class
+MEDIA_CLASSES = {
+    'audioItem': 'audio',
+    'videoItem': 'video',
+    'imageItem': 'image',
+}
+
 
 class Protocol:
     def __init__(self):
         self._handler = None
+        self.renderer_cache = BusCache('get_renderer')
 
     @property
     def handler(self):
@@ -60,11 +73,10 @@ class Protocol:
 
     @property
     def renderer(self):
-        renderers = cherrypy.engine.publish('get_renderer')
-        if len(renderers) == 0:
+        renderer = self.renderer_cache.get()
+        if renderer is None:
             logger.error("Unable to find an available renderer.")
-            return None
-        return renderers.pop()
+        return renderer
 
     # The following methods are called by the renderer to set the playback status within the protocol,
     # which will be passed to the client (generally the mobile phone)
@@ -147,6 +159,12 @@ class Protocol:
     def set_state_url(self, data: str):
         pass
 
+    def set_state_next_track(self):
+        """ The renderer has started playing the media set by SetNextAVTransportURI
+        :return:
+        """
+        pass
+
     def set_state(self, state_name, state_value):
         pass
 
@@ -453,18 +471,18 @@ class DLNAProtocol(Protocol):
     def add_subscribe(self, service, url, timeout=1800):
         """Add a DLNA client to subscribe list
         """
-        logger.error("SUBSCRIBE: " + url)
+        logger.info("SUBSCRIBE: %s", url)
         for client in self.event_subscribes:
             if self.event_subscribes[client].url == url and \
                     self.event_subscribes[client].service == service:
                 s = self.event_subscribes[client]
                 s.update(timeout)
-                logger.error("SUBSCRIBE UPDATE")
+                logger.debug("SUBSCRIBE UPDATE")
                 return {
                     "SID": s.sid,
                     "TIMEOUT": "Second-{}".format(s.timeout)
                 }
-        logger.error("SUBSCRIBE ADD")
+        logger.debug("SUBSCRIBE ADD")
         client = ObserveClient(service, url, timeout)
         self.append_device_queue.put(client)
         threading.Thread(target=self.send_init_event,
@@ -537,6 +555,8 @@ class DLNAProtocol(Protocol):
                 if len(state) == 0:
                     continue
                 client.send_event_callback(state)
+                if state.get('TransportState', None) == 'PLAYING':
+                    cherrypy.engine.publish('cast_trace', 'event_playing')
 
             except Exception as e:
                 logger.error("send event error: " + str(e))
@@ -583,7 +603,7 @@ class DLNAProtocol(Protocol):
             'AVTransport_GetTransportInfo',
             'RenderingControl_GetVolume'
         ]:
-            logger.info("{} {}".format(method, param))
+            logger.info("%s %s", method, param)
         res = {}
         service_type = Service.get(service)
         if hasattr(self, method):
@@ -598,14 +618,11 @@ class DLNAProtocol(Protocol):
                     self.set_state(arg.state, param[arg.name])
             res = getattr(self, method)(data)
         else:
-            # output = self.action_list[service][action].output
-            output = service_type.actions[action].output
-            for arg in output:
-                res[arg.name] = self.state_list[arg.state].value
+            res = self.get_action_output(service, action)
         if method not in ['ConnectionManager_GetProtocolInfo', 'AVTransport_GetPositionInfo']:
-            logger.info("{}res: {}".format("*" * 20, res))
+            logger.debug("%sres: %s", "*" * 20, res)
         else:
-            logger.info("{}res: {}".format("*" * 20, method))
+            logger.debug("%sres: %s", "*" * 20, method)
 
         # build response xml
         ns = 'http://schemas.xmlsoap.org/soap/envelope/'
@@ -623,6 +640,16 @@ class DLNAProtocol(Protocol):
             prop.text = str(res[key])
         return etree.tostring(root, encoding="UTF-8", xml_declaration=False)
 
+    def get_action_output(self, service, action):
+        """Get the output of action from the state variables
+        according to the **action return value** described in the XML file.
+        """
+        res = {}
+        # output = self.action_list[service][action].output
+        for arg in Service.get(service).actions[action].output:
+            res[arg.name] = self.state_list[arg.state].value
+        return res
+
     def set_state(self, name: str, value) -> None:
         """Set DLNA state which defined by xml file
         :param name: state name
@@ -632,7 +659,7 @@ class DLNAProtocol(Protocol):
         # update states which will send to DLNA Client
         if name in SERVICE_STATE_OBSERVED['AVTransport'] or \
                 name in SERVICE_STATE_OBSERVED['RenderingControl']:
-            logger.debug("setState: {} {}".format(name, value))
+            logger.debug("setState: %s %s", name, value)
             # When some states change, the DLNA client needs to be notified immediately
             # We put this kind of state into state_queue, waiting to be sent to client.
             self.state_queue.put((name, value))
@@ -679,24 +706,62 @@ class DLNAProtocol(Protocol):
         self.renderer.set_media_mute(mute)
         return {}
 
-    def AVTransport_SetAVTransportURI(self, data):
-        uri = data['CurrentURI'].value
-        logger.info(uri)
-        self.set_state_url(uri)
-        self.renderer.set_media_url(uri)
+    @staticmethod
+    def parse_metadata(metadata):
+        """Get title and media class from DIDL-Lite metadata
+        :param metadata: DIDL-Lite xml string
+        :return: (title, metadata, media_class)
+            media_class: 'audio', 'video', 'image' or '' (unknown)
+        """
         title = Setting.get_friendly_name()
+        media_class = ''
+        if not metadata:
+            return title, metadata, media_class
         try:
-            meta = etree.fromstring(data['CurrentURIMetaData'].value.encode())
+            meta = etree.fromstring(metadata.encode())
             title_xml = meta.find('.//{{{}}}title'.format(meta.nsmap['dc']))
             if title_xml is not None and title_xml.text is not None:
                 title = title_xml.text
-            metadata = etree.tostring(meta, encoding="UTF-8", xml_declaration=False)
+            class_xml = meta.find('.//{{{}}}class'.format(UPNP_METADATA_NS))
+            if class_xml is not None and class_xml.text is not None:
+                # eg: object.item.audioItem.musicTrack
+                for item, name in MEDIA_CLASSES.items():
+                    if item in class_xml.text.split('.'):
+                        media_class = name
+                        break
+            metadata = etree.tostring(meta, encoding="UTF-8", xml_declaration=False).decode()
         except Exception as e:
             logger.error(str(e))
-            logger.error(data['CurrentURIMetaData'].value)
-            self.set_state('CurrentTrackMetaData', data['CurrentURIMetaData'].value)
-        else:
-            self.set_state('CurrentTrackMetaData', metadata.decode())
+            logger.error(metadata)
+        return title, metadata, media_class
+
+    @staticmethod
+    def media_url(uri):
+        """Get the url passed to renderer, which may be served by the local media proxy
+        see also: proxy.py -> class MediaProxy
+        """
+        if not uri:
+            return ''
+        urls = cherrypy.engine.publish('get_media_proxy_url', uri)
+        return urls.pop() if len(urls) > 0 else uri
+
+    def AVTransport_SetAVTransportURI(self, data):
+        uri = data['CurrentURI'].value
+        logger.info(uri)
+        cherrypy.engine.publish('cast_trace_begin', uri,
+                                getattr(cherrypy.request, 'received', None))
+        url = self.media_url(uri)
+        # warm up the connection while DIDL parsing and renderer dispatching
+        cherrypy.engine.publish('prewarm_media', uri)
+        self.set_state_url(uri)
+        self.set_state('NextAVTransportURI', '')
+        self.set_state('NextAVTransportURIMetaData', '')
+        title, metadata, media_class = self.parse_metadata(data['CurrentURIMetaData'].value)
+        # the player profile must be chosen before loading the media
+        self.renderer.set_media_class(media_class)
+        cherrypy.engine.publish('cast_trace', 'set_media_url')
+        self.renderer.set_media_url(url)
+        self.set_state('CurrentTrackMetaData', metadata)
         self.renderer.set_media_title(title)
         self.renderer.set_media_resume()
         self.set_state('CurrentTrackTitle', title)
@@ -707,6 +772,13 @@ class DLNAProtocol(Protocol):
         self.set_state('TransportStatus', 'OK')
         return {}
 
+    def AVTransport_SetNextAVTransportURI(self, data):
+        uri = data['NextURI'].value
+        logger.info(uri)
+        _, _, media_class = self.parse_metadata(data['NextURIMetaData'].value)
+        self.renderer.set_media_next_url(self.media_url(uri), media_class)
+        return {}
+
     def AVTransport_Play(self, data):
         self.renderer.set_media_resume()
         self.set_state('TransportState', 'PLAYING')
@@ -730,6 +802,13 @@ class DLNAProtocol(Protocol):
         self.set_state('TransportState', 'STOPPED')
         return {}
 
+    def AVTransport_GetPositionInfo(self, data):
+        renderer = self.renderer
+        position = None if renderer is None else renderer.get_media_position()
+        if position is not None:
+            self.set_state_position(position)
+        return self.get_action_output('AVTransport', 'GetPositionInfo')
+
     # The following methods are usually used to update the states of
     # DLNA Renderer according to the status obtained from the player.
     # So, when your player state changes, call the following methods.
@@ -804,6 +883,17 @@ class DLNAProtocol(Protocol):
     def set_state_url(self, data: str):
         self.set_state('CurrentTrackURI', data)
 
+    def set_state_next_track(self):
+        uri = self.get_state('NextAVTransportURI')
+        title, metadata, _ = self.parse_metadata(self.get_state('NextAVTransportURIMetaData'))
+        self.set_state('AVTransportURI', uri)
+        self.set_state('AVTransportURIMetaData', metadata)
+        self.set_state('CurrentTrackURI', uri)
+        self.set_state('CurrentTrackMetaData', metadata)
+        self.set_state('CurrentTrackTitle', title)
+        self.set_state('NextAVTransportURI', '')
+        self.set_state('NextAVTransportURIMetaData', '')
+
     # When you are implementing another protocol similar to DLNA,
     # you can get the status of DLNA renderer by calling the following methods.
     # Using DLNA protocol usually does not need to pay attention to these methods,
@@ -868,31 +958,21 @@ class DLNAProtocol(Protocol):
 class Handler:
 
     def __init__(self):
-        self.setting_page = load_xml(XMLPath.SETTING_PAGE.value).encode()
-        self.__downloading = False
+        self.setting_page = CachedDocument(load_xml(XMLPath.SETTING_PAGE.value).encode(),
+                                           'text/html; charset=utf-8')
+        self.protocol_cache = BusCache('get_protocol')
 
     @property
     def protocol(self) -> Protocol:
-        protocols = cherrypy.engine.publish('get_protocol')
-        if len(protocols) == 0:
+        protocol = self.protocol_cache.get()
+        if protocol is None:
             logger.error("Unable to find an available protocol.")
             return Protocol()
-        return protocols.pop()
+        return protocol
 
     def reload(self):
         cherrypy.server.httpserver = _cpnative_server.CPHTTPServer(cherrypy.server)
 
-    def __download_plugin(self, path, url):
-        try:
-            with open(path, 'wb') as f:
-                f.write(requests.get(url).content)
-        except Exception as e:
-            logger.error(f"download plugin error: {e}")
-        finally:
-            self.__downloading = False
-            Setting.restart()
-            # cherrypy.engine.restart()
-
     def GET(self, param=None, *args, **kwargs):
         if not Setting.is_service_running():
             raise cherrypy.HTTPError(503, 'Server restarting')
@@ -900,20 +980,63 @@ class Handler:
             cherrypy.response.headers['Content-Type'] = 'application/json;charset:utf-8'
             query = kwargs.get('query', '')
             res = {
-                'api?query=log': 'get logs of macast',
+                'api?query=log': 'get logs of macast, '
+                                 'with tail=<lines> (default) or offset=<byte>&limit=<bytes>',
+                'api?query=log&follow=1': 'server-sent events of new logs, from offset or the end',
+                'api?query=log-level': 'get level of each logger, '
+                                       'POST log-level={"name", "level", "sample_rate"} to change',
                 'api?query=settings': 'get settings of macast',
+                'api?query=player-log': 'get recent output of the player',
+                'api?query=cache': 'get cache status of the player',
+                'api?query=renderer-metrics': 'get startup latency and reload downtime of the player',
+                'api?query=sessions': 'get playback quality of recent media',
+                'api?query=latency': 'get latency of each stage of recent casts',
+                'api?query=proxy': 'get cache status of the media proxy',
+                'api?query=hls': 'get status of the HLS prefetcher',
+                'api?query=plugin-install': 'get progress of plugin installing',
             }
             if query == 'log':
-                log_path = os.path.join(SETTING_DIR, 'macast.log')
-                data = ''
                 try:
-                    with open(log_path, 'r', encoding='utf-8') as f:
-                        data = f.read()
-                except:
-                    pass
-                res = {"logs": data}
+                    offset = kwargs.get('offset', None)
+                    offset = cherrypy.request.headers.get('Last-Event-ID', offset)
+                    offset = None if offset is None else int(offset)
+                    limit = int(kwargs.get('limit', logfile.READ_LIMIT))
+                    tail = int(kwargs.get('tail', logfile.DEFAULT_TAIL_LINES))
+                except ValueError:
+                    raise cherrypy.HTTPError(400, 'offset, limit and tail should be integers')
+                if kwargs.get('follow', None) is not None:
+                    cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+                    cherrypy.response.headers['Cache-Control'] = 'no-cache'
+                    cherrypy.response.stream = True
+                    return logfile.follow(offset)
+                if offset is None:
+                    res = logfile.read_tail(tail)
+                else:
+                    res = logfile.read_range(offset, limit)
+            elif query == 'log-level':
+                res = logfile.get_log_levels()
             elif query == 'launch-param':
                 res = Setting.setting
+            elif query == 'player-log':
+                renderer = self.protocol.renderer
+                res = {"logs": [] if renderer is None else renderer.get_player_log()}
+            elif query == 'cache':
+                renderer = self.protocol.renderer
+                res = {} if renderer is None else renderer.get_cache_info()
+            elif query == 'renderer-metrics':
+                renderer = self.protocol.renderer
+                res = {} if renderer is None else renderer.get_metrics()
+            elif query == 'sessions':
+                renderer = self.protocol.renderer
+                res = {"sessions": [] if renderer is None else renderer.get_sessions()}
+            elif query == 'latency':
+                res = cherrypy_publish('get_cast_trace_info', {})
+            elif query == 'proxy':
+                res = cherrypy_publish('get_proxy_info', {})
+            elif query == 'hls':
+                res = cherrypy_publish('get_hls_info', {})
+            elif query == 'plugin-install':
+                res = cherrypy_publish('get_plugin_install_info', {})
             elif query == 'plugin-info':
                 info = cherrypy_publish('get_plugin_info', [])
                 res = {
@@ -924,9 +1047,7 @@ class Handler:
             return json.dumps(res, indent=4).encode()
         if param is not None:
             raise cherrypy.HTTPRedirect('/')
-        cherrypy.response.headers['Content-Type'] = 'text/html'
-        # return self.setting_page
-        return load_xml(XMLPath.SETTING_PAGE.value).encode()
+        return self.setting_page.serve()
 
     def POST(self, *args, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json;charset:utf-8'
@@ -943,25 +1064,35 @@ class Handler:
                 Setting.save()
                 Setting.restart()
                 # cherrypy.engine.restart()
+        elif kwargs.get('log-level', None) is not None:
+            try:
+                data = json.loads(kwargs.get('log-level'))
+                success = logfile.set_log_level(data['name'], data.get('level', None),
+                                                data.get('sample_rate', None))
+            except (ValueError, TypeError, KeyError):
+                success = False
+            if not success:
+                res['code'] = 1
+                res['message'] = 'unknown logger or level'
         elif kwargs.get('install-plugin', None) is not None:
             plugin = kwargs.get('install-plugin', None)
-            if self.__downloading:
-                cherrypy.engine.publish('app_notify', 'ERROR', 'Downloading other plugin now')
+            try:
+                plugin = json.loads(plugin)
+                result = cherrypy.engine.publish('install_plugin',
+                                                 plugin.get('type', 'renderer'),
+                                                 plugin.get('url', ''),
+                                                 plugin.get('sha256', None))
+            except (ValueError, AttributeError):
                 res['code'] = 1
-                res['message'] = 'Downloading other plugin now'
+                res['message'] = 'json format error'
             else:
-                cherrypy.engine.publish('app_notify', 'INFO', 'installing plugin...')
-                self.__downloading = True
-                try:
-                    plugin = json.loads(plugin)
-                    url = plugin.get('url', '')
-                    plugin_name = url.split('/')[-1]
-                    local_path = os.path.join(SETTING_DIR, plugin.get('type', 'renderer'), plugin_name)
-                    threading.Thread(target=self.__download_plugin(local_path, url),
-                                     daemon=True).start()
-                except Exception as e:
+                success, message = result.pop() if len(result) > 0 else (False, 'Installer is not running')
+                if success:
+                    cherrypy.engine.publish('app_notify', 'INFO', 'installing plugin...')
+                else:
+                    cherrypy.engine.publish('app_notify', 'ERROR', message)
                     res['code'] = 1
-                    res['message'] = 'json format error'
+                res['message'] = message
         else:
             logger.info(kwargs)
 
@@ -978,6 +1109,7 @@ class DLNAHandler(Handler):
     def __init__(self):
         super(DLNAHandler, self).__init__()
         self.description = None
+        self.documents = {}  # path -> CachedDocument, rebuilt by build_description
         self.reload()
 
     def reload(self):
@@ -986,11 +1118,11 @@ class DLNAHandler(Handler):
 
     @property
     def protocol(self) -> DLNAProtocol:
-        protocols = cherrypy.engine.publish('get_protocol')
-        if len(protocols) == 0:
+        protocol = self.protocol_cache.get()
+        if protocol is None:
             logger.error("Unable to find an available protocol.")
             return DLNAProtocol()
-        return protocols.pop()
+        return protocol
 
     def build_description(self):
         self.description = load_xml(XMLPath.DESCRIPTION.value).format(
@@ -1006,20 +1138,33 @@ class DLNAHandler(Handler):
             header_extra="",
             service_extra=""
         ).encode()
+        content_type = 'text/xml; charset="utf-8"'
+        documents = {'description.xml': CachedDocument(self.description, content_type)}
+        # SCPD documents only change with the version of Macast
+        for path in [XMLPath.AV_TRANSPORT.value,
+                     XMLPath.RENDERING_CONTROL.value,
+                     XMLPath.CONNECTION_MANAGER.value]:
+            with open(path, 'rb') as f:
+                documents['dlna/' + os.path.basename(path)] = CachedDocument(
+                    f.read(), content_type, 'max-age=3600', os.path.getmtime(path))
+        self.documents = documents
 
     def GET(self, param=None, *args, **kwargs):
-        if param == 'description.xml':
-            return self.description
+        document = self.documents.get('/'.join((param,) + args) if param else '', None)
+        if document is not None:
+            return document.serve()
         return super(DLNAHandler, self).GET(param, *args, **kwargs)
 
     def POST(self, service=None, param=None, *args, **kwargs):
+        # start of cast latency, see also: trace.py
+        cherrypy.request.received = time.monotonic()
         length = cherrypy.request.headers['Content-Length']
         rawbody = cherrypy.request.body.read(int(length))
-        logger.debug('RAW: {}'.format(rawbody))
+        logger.debug('RAW: %s', rawbody)
         if param == 'action':
             res = self.protocol.call(rawbody)
             cherrypy.response.headers['EXT'] = ''
-            logger.debug('RES: {}'.format(res))
+            logger.debug('RES: %s', res)
             return res
         return super(DLNAHandler, self).POST(service, param, *args, **kwargs)
 
@@ -1033,21 +1178,21 @@ class DLNAHandler(Handler):
             TIMEOUT = TIMEOUT if TIMEOUT is not None else 'Second-1800'
             TIMEOUT = int(TIMEOUT.split('-')[-1])
             if SID:
-                logger.error("RENEW SUBSCRIBE:!!!!!!!" + service)
+                logger.info("RENEW SUBSCRIBE: %s", service)
                 res = self.protocol.renew_subscribe(SID, TIMEOUT)
                 if res != 200:
-                    logger.error("RENEW SUBSCRIBE: cannot find such sid.")
+                    logger.warning("RENEW SUBSCRIBE: cannot find such sid.")
                     raise cherrypy.HTTPError(status=res)
                 cherrypy.response.headers['SID'] = SID
                 cherrypy.response.headers['TIMEOUT'] = TIMEOUT
             elif CALLBACK:
-                logger.error("ADD SUBSCRIBE:!!!!!!!" + service)
+                logger.info("ADD SUBSCRIBE: %s", service)
                 suburl = re.findall("<(.*?)>", CALLBACK)[0]
                 res = self.protocol.add_subscribe(service, suburl, TIMEOUT)
                 cherrypy.response.headers['SID'] = res['SID']
                 cherrypy.response.headers['TIMEOUT'] = res['TIMEOUT']
             else:
-                logger.error("SUBSCRIBE: cannot find sid and callback.")
+                logger.warning("SUBSCRIBE: cannot find sid and callback.")
                 raise cherrypy.HTTPError(status=412)
         return b''
 
@@ -1057,10 +1202,10 @@ class DLNAHandler(Handler):
         if param == 'event':
             SID = cherrypy.request.headers.get('SID')
             if SID:
-                logger.error("REMOVE SUBSCRIBE:!!!!!!!" + service)
+                logger.info("REMOVE SUBSCRIBE: %s", service)
                 res = self.protocol.remove_subscribe(SID)
                 if res != 200:
                     raise cherrypy.HTTPError(status=res)
                 return b''
-        logger.error("UNSUBSCRIBE: error 412.")
+        logger.warning("UNSUBSCRIBE: error 412.")
         raise cherrypy.HTTPError(status=412)
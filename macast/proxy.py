@@ -0,0 +1,559 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Local Media Proxy
+# MediaProxy: serving byte ranges of remote media from a disk-backed block cache,
+# so seeks and replays of slow DLNA servers are served from local disk.
+# HLSProxy: prefetching the next segments of HLS playlists in parallel.
+#
+
+import os
+import re
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import cherrypy
+from urllib.parse import quote, urljoin, urlparse
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .utils import Setting, SettingProperty, SETTING_DIR, LazySession
+
+logger = logging.getLogger("Proxy")
+logger.setLevel(logging.INFO)
+
+BLOCK_SIZE = 1024 * 1024
+READ_AHEAD_BLOCKS = 4
+HLS_CACHE_SIZE = 64 * 1024 * 1024
+# number of urls remembered by each UrlRegistry
+URL_REGISTRY_SIZE = 64
+
+
+class UrlRegistry:
+    """Origin urls handed out to renderer, the proxies refuse any other url,
+    so they cannot be used to fetch arbitrary urls from the local network
+    """
+
+    def __init__(self, max_size=URL_REGISTRY_SIZE):
+        self.max_size = max_size
+        self.urls = OrderedDict()  # url -> None, least recently added first
+        self.lock = threading.Lock()
+
+    def __contains__(self, url):
+        with self.lock:
+            return url in self.urls
+
+    def add(self, url):
+        with self.lock:
+            self.urls.pop(url, None)
+            self.urls[url] = None
+            while len(self.urls) > self.max_size:
+                self.urls.popitem(last=False)
+
+
+media_urls = UrlRegistry()  # urls served by MediaProxy
+playlist_urls = UrlRegistry()  # playlists served by HLSProxy
+
+
+def rewrite_url(url):
+    """Get the url which renderer should play
+    see also: protocol.py -> DLNAProtocol.media_url
+    """
+    if not url:
+        # empty NextURI means there is no next media
+        return ''
+    if not re.match(r'https?://', url):
+        return url
+    if HLSProxy.is_hls(url) and HLSProxy.enabled():
+        playlist_urls.add(url)
+        return HLSProxy.local_url('playlist', url)
+    if MediaProxy.enabled():
+        media_urls.add(url)
+        return 'http://127.0.0.1:{}/proxy/?url={}'.format(Setting.get_port(), quote(url, safe=''))
+    return url
+
+
+def parse_range(header, length):
+    """Parse http Range header
+    :return: (start, end) inclusive, or None if the range is not satisfiable
+    """
+    if not header:
+        return 0, length - 1
+    match = re.match(r'bytes=(\d*)-(\d*)', header)
+    if match is None:
+        return 0, length - 1
+    start, end = match.groups()
+    if start == '':
+        # suffix range: bytes=-500
+        if end == '':
+            return None
+        start, end = max(length - int(end), 0), length - 1
+    else:
+        start = int(start)
+        end = length - 1 if end == '' else min(int(end), length - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+class SharedFetch:
+    """Concurrent requests of the same key share one fetch
+    """
+
+    def __init__(self):
+        self.fetching = {}  # key -> Future, fetches in flight
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.fetching
+
+    def get(self, key, fetch):
+        """
+        :param fetch: function returns the data of key
+        :return: (data, shared)
+        """
+        with self.lock:
+            future = self.fetching.get(key, None)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.fetching[key] = future
+        if not owner:
+            return future.result(timeout=30), True
+        try:
+            future.set_result(fetch())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.fetching.pop(key, None)
+        return future.result(), False
+
+
+class MemoryCache:
+    """In-memory LRU cache bounded by total bytes
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.items = OrderedDict()  # key -> (content type, data), least recently used first
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, content_type, data):
+        with self.lock:
+            if key in self.items:
+                self.size -= len(self.items.pop(key)[1])
+            self.items[key] = (content_type, data)
+            self.size += len(data)
+            while self.size > self.max_size and len(self.items) > 1:
+                _, (_, old) = self.items.popitem(last=False)
+                self.size -= len(old)
+
+
+class BlockCache:
+    """Disk-backed LRU cache of media blocks
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.blocks = OrderedDict()  # key -> block size, least recently used first
+        self.lock = threading.Lock()
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def block_path(self, key):
+        return os.path.join(self.path, '{}_{}'.format(*key))
+
+    def __contains__(self, key):
+        return key in self.blocks
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.blocks:
+                return None
+            self.blocks.move_to_end(key)
+        try:
+            with open(self.block_path(key), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            logger.error("read cache block error: {}".format(e))
+            with self.lock:
+                self.size -= self.blocks.pop(key, 0)
+            return None
+
+    def put(self, key, data):
+        with open(self.block_path(key), 'wb') as f:
+            f.write(data)
+        with self.lock:
+            self.size -= self.blocks.pop(key, 0)
+            self.blocks[key] = len(data)
+            self.size += len(data)
+            # evict least recently used blocks
+            while self.size > self.max_size and len(self.blocks) > 1:
+                old, size = self.blocks.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(self.block_path(old))
+                except OSError:
+                    pass
+
+
+@cherrypy.expose
+class MediaProxy:
+    """Mounted at /proxy, see Service
+    Media urls passed to renderer are rewritten to
+    http://127.0.0.1:port/proxy/?url=origin_url when MediaProxy is enabled,
+    only urls rewritten by rewrite_url are served
+    see also: rewrite_url
+    """
+    _cp_config = {'response.stream': True}
+
+    def __init__(self):
+        self.session = LazySession()
+        self.executor = ThreadPoolExecutor(max_workers=READ_AHEAD_BLOCKS,
+                                           thread_name_prefix="PROXY_READ_AHEAD")
+        self.cache = None
+        # url -> (content type, content length), None if ranges are unsupported,
+        # bounded like the urls it may be asked for, see UrlRegistry
+        self.media = OrderedDict()
+        self.media_lock = threading.Lock()
+        self.probing = SharedFetch()  # probes of media in flight, see prewarm
+        self.fetching = SharedFetch()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # requests joined a fetch in flight
+
+    @staticmethod
+    def enabled():
+        return Setting.get(SettingProperty.MediaProxy, 0) == 1
+
+    def get_cache(self):
+        if self.cache is None:
+            max_size = Setting.get(SettingProperty.MediaProxy_CacheSize, 512) * 1024 * 1024
+            self.cache = BlockCache(os.path.join(SETTING_DIR, 'cache'), max_size)
+        return self.cache
+
+    def get_info(self):
+        total = self.hits + self.misses
+        cache = self.cache
+        return {
+            'enabled': self.enabled(),
+            'cache_size': 0 if cache is None else cache.size,
+            'cache_max_size': 0 if cache is None else cache.max_size,
+            'blocks': 0 if cache is None else len(cache.blocks),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'hit_rate': self.hits / total if total > 0 else 0,
+        }
+
+    def get_media(self, url):
+        """Get content type and length of the url
+        :return: (content type, content length) or None if the origin don't support ranges
+        """
+        with self.media_lock:
+            if url in self.media:
+                return self.media[url]
+        # the request of renderer joins the probe started by prewarm
+        return self.probing.get(url, lambda: self.probe_media(url))[0]
+
+    def probe_media(self, url):
+        """Request the first byte of url, the connection is kept alive for the blocks
+        :return: same as get_media, None if failed
+        """
+        start = time.monotonic()
+        media = None
+        try:
+            res = self.session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=10)
+            length = res.headers.get('Content-Range', '').split('/')[-1]
+            if res.status_code == 206 and length.isdigit():
+                # read the only byte, so the connection can be reused
+                res.content
+                media = (res.headers.get('Content-Type', 'application/octet-stream'), int(length))
+            else:
+                res.close()
+        except Exception as e:
+            logger.error("proxy probe error: {}".format(e))
+            return None
+        logger.info("probe media: {} in {:.3f}s".format(media, time.monotonic() - start))
+        with self.media_lock:
+            self.media[url] = media
+            while len(self.media) > URL_REGISTRY_SIZE:
+                self.media.popitem(last=False)
+        return media
+
+    def prewarm(self, url):
+        """Called as soon as DLNA client sets the media url
+        The origin is probed and the first block is fetched in the background
+        while the metadata is parsed and renderer starts, so the first request
+        of renderer doesn't wait for them.
+        see also: protocol.py -> DLNAProtocol.AVTransport_SetAVTransportURI
+        """
+        if self.enabled() and url in media_urls and url not in self.media and url not in self.probing:
+            self.executor.submit(self.warm, url)
+
+    def warm(self, url):
+        media = self.get_media(url)
+        if media is not None:
+            self.fetch_block(url, 0, media[1])
+
+    def download(self, url, index, length):
+        start = index * BLOCK_SIZE
+        end = min(start + BLOCK_SIZE, length) - 1
+        res = self.session.get(url, headers={'Range': 'bytes={}-{}'.format(start, end)}, timeout=10)
+        if res.status_code != 206:
+            raise IOError("origin response {} for range {}-{}".format(res.status_code, start, end))
+        return res.content
+
+    def fetch_block(self, url, index, length):
+        """Get a block from cache, or from origin
+        Concurrent requests of the same block share one fetch.
+        """
+        cache = self.get_cache()
+        key = (hashlib.sha1(url.encode()).hexdigest(), index)
+        data = cache.get(key)
+        if data is not None:
+            self.hits += 1
+            return data
+
+        def fetch():
+            self.misses += 1
+            block = self.download(url, index, length)
+            cache.put(key, block)
+            return block
+
+        data, shared = self.fetching.get(key, fetch)
+        if shared:
+            self.shared += 1
+        return data
+
+    def read_ahead(self, url, index, length):
+        cache = self.get_cache()
+        url_hash = hashlib.sha1(url.encode()).hexdigest()
+        last = (length - 1) // BLOCK_SIZE
+        for i in range(index + 1, min(index + READ_AHEAD_BLOCKS, last) + 1):
+            key = (url_hash, i)
+            if key not in cache and key not in self.fetching:
+                self.executor.submit(self.fetch_block, url, i, length)
+
+    def stream(self, url, start, end, length):
+        index = start // BLOCK_SIZE
+        position = start
+        while position <= end:
+            data = self.fetch_block(url, index, length)
+            if not data:
+                break
+            self.read_ahead(url, index, length)
+            block_start = index * BLOCK_SIZE
+            yield data[position - block_start:end - block_start + 1]
+            position = block_start + len(data)
+            index += 1
+
+    def GET(self, url=None, **kwargs):
+        if not self.enabled() or url not in media_urls:
+            raise cherrypy.NotFound()
+        media = self.get_media(url)
+        if media is None:
+            # cannot cache media without range support
+            raise cherrypy.HTTPRedirect(url)
+        content_type, length = media
+        header = cherrypy.request.headers.get('Range', None)
+        byte_range = parse_range(header, length)
+        if byte_range is None:
+            cherrypy.response.headers['Content-Range'] = 'bytes */{}'.format(length)
+            raise cherrypy.HTTPError(416)
+        start, end = byte_range
+        cherrypy.response.headers['Content-Type'] = content_type
+        cherrypy.response.headers['Accept-Ranges'] = 'bytes'
+        cherrypy.response.headers['Content-Length'] = str(end - start + 1)
+        if header:
+            cherrypy.response.status = 206
+            cherrypy.response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, length)
+        return self.stream(url, start, end, length)
+
+
+@cherrypy.expose
+class HLSProxy:
+    """Mounted at /hls, see Service
+    HLS playlists passed to renderer are rewritten to
+    http://127.0.0.1:port/hls/playlist?url=origin_url when HLSPrefetch is enabled.
+    Playlists are always fetched from origin, so live playlists keep refreshing,
+    segment urls inside are rewritten to /hls/segment, and when renderer requests
+    a segment, the next segments are fetched in parallel into a memory cache.
+    Only playlists rewritten by rewrite_url or listed in them, and segments of
+    fetched playlists are served.
+    """
+
+    def __init__(self):
+        self.session = LazySession()
+        self.executor = None
+        self.cache = MemoryCache(HLS_CACHE_SIZE)
+        self.fetching = SharedFetch()
+        self.segments = {}  # playlist url -> segment urls
+        self.segment_index = {}  # segment url -> (playlist url, index)
+        self.last_segment = {}  # playlist url -> the last segment url requested
+        self.hits = 0
+        self.misses = 0
+        self.current = None  # None: not HLS, True: prefetching, False: direct
+        self.rebuffer = {'prefetch': 0, 'direct': 0}
+
+    @staticmethod
+    def enabled():
+        return Setting.get(SettingProperty.HLSPrefetch, 0) == 1
+
+    @staticmethod
+    def is_hls(url):
+        return urlparse(url).path.lower().endswith('.m3u8')
+
+    @staticmethod
+    def local_url(kind, url):
+        return 'http://127.0.0.1:{}/hls/{}?url={}'.format(Setting.get_port(), kind, quote(url, safe=''))
+
+    def set_current(self, uri):
+        """Called when renderer starts playing a media, see renderer_av_uri
+        Preloading the next media doesn't change the current one.
+        :param uri: origin url of the media
+        """
+        if not uri or not self.is_hls(uri):
+            self.current = None
+        else:
+            self.current = uri in playlist_urls
+
+    def on_rebuffer(self):
+        """Count rebuffers of HLS media, with and without prefetcher
+        """
+        if self.current is not None:
+            self.rebuffer['prefetch' if self.current else 'direct'] += 1
+
+    def get_info(self):
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled(),
+            'cache_size': self.cache.size,
+            'segments': len(self.cache.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0,
+            'rebuffer': self.rebuffer,
+        }
+
+    def playlist_url(self, url):
+        """Rewrite the url of a variant or rendition playlist
+        """
+        playlist_urls.add(url)
+        return self.local_url('playlist', url)
+
+    def rewrite_playlist(self, url, base, text):
+        """Rewrite urls in playlist
+        Variant playlists are proxied, segments are proxied unless they are byte ranges,
+        other urls are resolved to absolute urls.
+        :param url: playlist url
+        :param base: playlist url after redirect, relative urls are resolved against it
+        :param text: playlist content
+        :return: rewritten playlist
+        """
+        lines = []
+        segments = []
+        byte_range = '#EXT-X-BYTERANGE' in text
+        variant = False
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('#'):
+                variant = variant or line.startswith('#EXT-X-STREAM-INF')
+                kind = 'playlist' if line.startswith('#EXT-X-MEDIA:') else None
+                line = re.sub(r'URI="([^"]+)"', lambda m: 'URI="{}"'.format(
+                    self.playlist_url(urljoin(base, m.group(1))) if kind else urljoin(base, m.group(1))), line)
+            elif line:
+                uri = urljoin(base, line)
+                if variant:
+                    line = self.playlist_url(uri)
+                elif byte_range:
+                    line = uri
+                else:
+                    segments.append(uri)
+                    line = self.local_url('segment', uri)
+            lines.append(line)
+        if segments:
+            for old in self.segments.get(url, []):
+                self.segment_index.pop(old, None)
+            self.segments[url] = segments
+            for i, segment in enumerate(segments):
+                self.segment_index[segment] = (url, i)
+        return '\n'.join(lines) + '\n'
+
+    def get_segment(self, url):
+        item = self.cache.get(url)
+        if item is not None:
+            self.hits += 1
+            return item
+
+        def fetch():
+            self.misses += 1
+            res = self.session.get(url, timeout=10)
+            res.raise_for_status()
+            self.cache.put(url, res.headers.get('Content-Type', 'video/mp2t'), res.content)
+            return self.cache.get(url)
+
+        return self.fetching.get(url, fetch)[0]
+
+    def prefetch(self, playlist, segment):
+        """Fetch the segments after the segment in parallel
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=Setting.get(SettingProperty.HLSPrefetch_Segments, 3),
+                thread_name_prefix="HLS_PREFETCH")
+        segments = self.segments.get(playlist, [])
+        _, index = self.segment_index.get(segment, (playlist, -1))
+        count = Setting.get(SettingProperty.HLSPrefetch_Segments, 3)
+        for url in segments[index + 1:index + 1 + count]:
+            if url not in self.cache and url not in self.fetching:
+                self.executor.submit(self.get_segment, url)
+
+    def GET(self, kind=None, url=None, **kwargs):
+        if not self.enabled() or url is None:
+            raise cherrypy.NotFound()
+        if kind == 'playlist':
+            if url not in playlist_urls:
+                raise cherrypy.NotFound()
+            try:
+                res = self.session.get(url, timeout=10)
+            except Exception as e:
+                logger.error("hls playlist error: {}".format(e))
+                raise cherrypy.HTTPError(502)
+            if res.status_code != 200:
+                raise cherrypy.HTTPError(res.status_code)
+            text = self.rewrite_playlist(url, res.url, res.text)
+            if url in self.last_segment:
+                # live playlist refreshed
+                self.prefetch(url, self.last_segment[url])
+            cherrypy.response.headers['Content-Type'] = 'application/vnd.apple.mpegurl'
+            return text.encode()
+        elif kind == 'segment':
+            playlist, _ = self.segment_index.get(url, (None, 0))
+            if playlist is None:
+                raise cherrypy.NotFound()
+            self.last_segment[playlist] = url
+            self.prefetch(playlist, url)
+            try:
+                content_type, data = self.get_segment(url)
+            except Exception as e:
+                logger.error("hls segment error: {}".format(e))
+                raise cherrypy.HTTPError(502)
+            cherrypy.response.headers['Content-Type'] = content_type
+            return data
+        raise cherrypy.HTTPError(404)
@@ -5,6 +5,7 @@ import logging
 import cherrypy
 
 from .protocol import Protocol
+from .utils import BusCache
 
 logger = logging.getLogger("Renderer")
 logger.setLevel(logging.INFO)
@@ -23,6 +24,7 @@ class Renderer:
         _ = lang
         self.running = False
         self.renderer_setting = RendererSetting()
+        self.protocol_cache = BusCache('get_protocol')
 
     def start(self):
         """Start render thread
@@ -44,11 +46,11 @@ class Renderer:
 
     @property
     def protocol(self) -> Protocol:
-        protocols = cherrypy.engine.publish('get_protocol')
-        if len(protocols) == 0:
+        protocol = self.protocol_cache.get()
+        if protocol is None:
             logger.error("Unable to find an available protocol.")
             return Protocol()
-        return protocols.pop()
+        return protocol
 
     # If you want to write a new renderer adapted to another video player,
     # please rewrite the following methods to control the video player you use.
@@ -127,6 +129,56 @@ class Renderer:
     def set_media_speed(self, data: float):
         pass
 
+    def set_media_class(self, data: str):
+        """ class of the media which will be set by set_media_url,
+        read from the upnp:class of DIDL-Lite metadata
+        :param data: 'audio', 'video', 'image' or '' (unknown)
+        :return:
+        """
+        pass
+
+    def set_media_next_url(self, url: str, media_class: str = ''):
+        """ preload the media which will be played after the current one
+        When the next media starts, call self.set_state_next_track()
+        :param url: empty string means there is no next media
+        :param media_class: same as set_media_class
+        :return:
+        """
+        pass
+
+    def get_media_position(self):
+        """ get the exact playback position from player
+        Called when the DLNA client asks for position (GetPositionInfo).
+        Renderers which update position by set_state_position continuously
+        don't need to rewrite this method.
+        :return: string position, 00:00:00; or None
+        """
+        return None
+
+    def get_player_log(self):
+        """ get the recent output of player, for diagnostics
+        :return: list of string
+        """
+        return []
+
+    def get_cache_info(self):
+        """ get the cache status of player, for diagnostics
+        :return: dict
+        """
+        return {}
+
+    def get_metrics(self):
+        """ get the startup and reload timing of player, for diagnostics
+        :return: dict
+        """
+        return {}
+
+    def get_sessions(self):
+        """ get the playback quality of recent media, for diagnostics
+        :return: list of dict, one for each played media
+        """
+        return []
+
     # The following methods are usually used to update the states of
     # DLNA Renderer according to the status obtained from the player.
     # So, when your player state changes, call the following methods.
@@ -197,6 +249,9 @@ class Renderer:
     def set_state_url(self, data: str):
         self.protocol.set_state_url(data)
 
+    def set_state_next_track(self):
+        self.protocol.set_state_next_track()
+
     def set_state(self, state_name, state_value):
         self.protocol.set_state(state_name, state_value)
 
@@ -9,9 +9,14 @@ import portend
 from cherrypy._cpserver import Server
 from cherrypy.process.plugins import Monitor
 
-from .utils import Setting, XMLPath, SettingProperty, SETTING_DIR
+from .utils import Setting, XMLPath, SettingProperty
 from .plugin import ProtocolPlugin, RendererPlugin, SSDPPlugin
 from .protocol import DLNAProtocol, Protocol, DLNAHandler
+from .proxy import MediaProxy, HLSProxy, rewrite_url
+from .trace import CastTracer
+from .installer import PluginInstaller
+from .static import AssetHandler
+from .logfile import setup_logging
 
 logger = logging.getLogger("server")
 logger.setLevel(logging.DEBUG)
@@ -81,6 +86,8 @@ class Service:
         cherrypy.server.unsubscribe()
         cherrypy.server = AutoPortServer()
         cherrypy.server.bind_addr = ('0.0.0.0', Setting.get_port())
+        # streaming responses (log follow, media proxy) hold a thread each
+        cherrypy.server.thread_pool = 20
         cherrypy.server.subscribe()
         # start plugins
         self.ssdp_plugin = SSDPPlugin(cherrypy.engine)
@@ -96,21 +103,11 @@ class Service:
         self.ssdp_monitor.subscribe()
         cherrypy.config.update({
             'log.screen': False,
-            'log.access_file': os.path.join(SETTING_DIR, 'macast.log'),
-            'log.error_file': os.path.join(SETTING_DIR, 'macast.log'),
         })
+        setup_logging()
         # cherrypy.engine.autoreload.files.add(Setting.setting_path)
+        # description.xml and /dlna/*.xml are cached by DLNAHandler
         cherrypy_config = {
-            '/dlna': {
-                'tools.staticdir.root': XMLPath.BASE_PATH.value,
-                'tools.staticdir.on': True,
-                'tools.staticdir.dir': "xml"
-            },
-            '/assets': {
-                'tools.staticdir.root': XMLPath.BASE_PATH.value,
-                'tools.staticdir.on': True,
-                'tools.staticdir.dir': "assets"
-            },
             '/': {
                 'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
                 'tools.response_headers.on': True,
@@ -121,6 +118,31 @@ class Service:
         }
 
         self.cherrypy_application = cherrypy.tree.mount(self.protocol.handler, '/', config=cherrypy_config)
+        cherrypy.tree.mount(AssetHandler(os.path.join(XMLPath.BASE_PATH.value, 'assets')),
+                            '/assets', config={
+                                '/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
+                            })
+        self.media_proxy = MediaProxy()
+        cherrypy.tree.mount(self.media_proxy, '/proxy', config={
+            '/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
+        })
+        self.hls_proxy = HLSProxy()
+        cherrypy.tree.mount(self.hls_proxy, '/hls', config={
+            '/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
+        })
+        cherrypy.engine.subscribe('get_media_proxy_url', rewrite_url)
+        cherrypy.engine.subscribe('get_proxy_info', self.media_proxy.get_info)
+        cherrypy.engine.subscribe('prewarm_media', self.media_proxy.prewarm)
+        cherrypy.engine.subscribe('get_hls_info', self.hls_proxy.get_info)
+        cherrypy.engine.subscribe('renderer_av_uri', self.hls_proxy.set_current)
+        cherrypy.engine.subscribe('renderer_rebuffer', self.hls_proxy.on_rebuffer)
+        self.cast_tracer = CastTracer()
+        cherrypy.engine.subscribe('cast_trace_begin', self.cast_tracer.begin)
+        cherrypy.engine.subscribe('cast_trace', self.cast_tracer.mark)
+        cherrypy.engine.subscribe('get_cast_trace_info', self.cast_tracer.get_info)
+        self.plugin_installer = PluginInstaller()
+        cherrypy.engine.subscribe('install_plugin', self.plugin_installer.install)
+        cherrypy.engine.subscribe('get_plugin_install_info', self.plugin_installer.get_info)
         cherrypy.engine.signals.subscribe()
 
     @property
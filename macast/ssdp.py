@@ -144,6 +144,10 @@ class SSDPServer:
             threading.Thread(target=lambda: Setting.stop_service(), name="SSDP_STOP_THREAD").start()
             return
         self.sock.settimeout(1)
+        # announce at once, instead of waiting for the first round of SSDP_NOTIFY_THREAD
+        for usn in list(self.known):
+            self.do_notify(usn)
+        cherrypy.engine.publish('ssdp_alive')
 
         while self.running:
             try:
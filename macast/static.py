@@ -0,0 +1,177 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Cached documents
+# Documents built once and served from memory with strong ETag, Last-Modified,
+# Cache-Control and gzip/brotli, so repeated requests become 304 or tiny responses.
+# AssetHandler: static files of the setting page served the same way.
+
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+import mimetypes
+import cherrypy
+from cherrypy.lib.static import serve_file
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("Static")
+logger.setLevel(logging.INFO)
+
+# smaller documents are not worth compressing
+GZIP_MIN_SIZE = 512
+# larger assets are served from disk instead of memory
+ASSET_MEMORY_MAX = 4 * 1024 * 1024
+# file names with a version (eg: vue@2.6.14.js) never change
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+ASSET_CACHE_CONTROL = 'public, max-age=86400'
+COMPRESSIBLE_TYPES = ['text/', 'application/javascript', 'application/json',
+                      'image/svg+xml', 'font/ttf', 'application/x-font-ttf']
+
+mimetypes.add_type('application/javascript', '.js')
+mimetypes.add_type('font/ttf', '.ttf')
+mimetypes.add_type('font/woff', '.woff')
+
+
+def accept_encoding(encoding):
+    """Check if the client of current request accepts the content encoding
+    """
+    header = cherrypy.request.headers.get('Accept-Encoding', '')
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() != encoding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        return quality > 0
+    return False
+
+
+class CachedDocument:
+    """A document served from memory, see also: protocol.py -> class DLNAHandler
+    """
+
+    def __init__(self, data: bytes, content_type, cache_control='no-cache',
+                 last_modified=None, compress=True):
+        """
+        :param data: content of document
+        :param content_type: eg: text/xml; charset="utf-8"
+        :param cache_control: value of Cache-Control header
+        :param last_modified: timestamp, time of building if None
+        :param compress: keep gzip and brotli (if installed) copies
+        """
+        self.data = data
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = int(time.time() if last_modified is None else last_modified)
+        self.etag = '"{}"'.format(hashlib.sha1(data).hexdigest()[:20])
+        self.gzip = None
+        self.brotli = None
+        if compress and len(data) >= GZIP_MIN_SIZE:
+            self.gzip = gzip.compress(data, 9)
+            if brotli is not None:
+                self.brotli = brotli.compress(data)
+
+    def is_modified(self):
+        """Check the validators of current request, If-None-Match is preferred
+        """
+        headers = cherrypy.request.headers
+        if_none_match = headers.get('If-None-Match', None)
+        if if_none_match is not None:
+            etags = [i.strip() for i in if_none_match.split(',')]
+            return '*' not in etags and self.etag not in etags
+        if_modified_since = headers.get('If-Modified-Since', None)
+        if if_modified_since is not None:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() < self.last_modified
+            except (TypeError, ValueError):
+                return True
+        return True
+
+    def serve(self):
+        """Set headers of current response
+        :return: body of response
+        """
+        response = cherrypy.response
+        response.headers['Content-Type'] = self.content_type
+        response.headers['ETag'] = self.etag
+        response.headers['Last-Modified'] = formatdate(self.last_modified, usegmt=True)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        if cherrypy.request.method in ['GET', 'HEAD'] and not self.is_modified():
+            response.status = 304
+            return b''
+        if self.brotli is not None and accept_encoding('br'):
+            response.headers['Content-Encoding'] = 'br'
+            return self.brotli
+        if self.gzip is not None and accept_encoding('gzip'):
+            response.headers['Content-Encoding'] = 'gzip'
+            return self.gzip
+        return self.data
+
+
+@cherrypy.expose
+class AssetHandler:
+    """Static files loaded once and served from memory with precompressed variants
+    see also: server.py -> class Service
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.files = self.scan(self.root)  # relative path -> full path, files allowed to serve
+        self.documents = {}  # relative path -> CachedDocument
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def scan(root):
+        """List files under root once, requests of other paths never touch the disk
+        """
+        files = {}
+        for dir_path, _, names in os.walk(root):
+            for name in names:
+                full_path = os.path.realpath(os.path.join(dir_path, name))
+                if full_path.startswith(root + os.sep) and os.path.isfile(full_path):
+                    files[os.path.relpath(os.path.join(dir_path, name), root).replace(os.sep, '/')] = full_path
+        return files
+
+    def load(self, path):
+        """Load a file in the allow-list
+        :return: CachedDocument, or file path for large files
+        """
+        full_path = self.files[path]
+        if os.path.getsize(full_path) > ASSET_MEMORY_MAX:
+            return full_path
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        logger.debug("load asset: {}".format(path))
+        return CachedDocument(
+            data,
+            content_type,
+            IMMUTABLE_CACHE_CONTROL if '@' in os.path.basename(path) else ASSET_CACHE_CONTROL,
+            os.path.getmtime(full_path),
+            any(content_type.startswith(i) for i in COMPRESSIBLE_TYPES))
+
+    def GET(self, *args, **kwargs):
+        path = '/'.join(args)
+        if path not in self.files:
+            raise cherrypy.NotFound()
+        with self.lock:
+            if path not in self.documents:
+                self.documents[path] = self.load(path)
+            document = self.documents[path]
+        if isinstance(document, str):
+            return serve_file(document)
+        return document.serve()
@@ -0,0 +1,172 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Cast latency tracing
+# Timestamps of one cast, from the SOAP request to the event reporting PLAYING,
+# are recorded under one correlation id through the cherrypy bus:
+#   cherrypy.engine.publish('cast_trace_begin', uri, received)
+#   cherrypy.engine.publish('cast_trace', stage)
+
+import time
+import uuid
+import logging
+import threading
+import collections
+
+logger = logging.getLogger("Trace")
+logger.setLevel(logging.INFO)
+
+# stages of a cast in order, each one is measured from the previous stage
+STAGES = [
+    'soap_received',  # DLNAHandler.POST
+    'dispatched',  # DLNAProtocol.call -> AVTransport_SetAVTransportURI
+    'set_media_url',  # Renderer.set_media_url
+    'start_file',  # player starts loading the media
+    'first_frame',  # player is ready to play
+    'event_playing',  # GENA event reporting PLAYING is sent
+]
+# upper bounds (ms) of histogram buckets
+BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+TRACE_HISTORY = 20
+# a cast not reaching the last stage in time is archived as incomplete
+TRACE_TIMEOUT = 60
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, ms):
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += ms
+
+    def to_dict(self):
+        buckets = {str(bound): self.counts[i] for i, bound in enumerate(BUCKETS)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'avg': round(self.sum / self.count, 1) if self.count else None,
+            'buckets': buckets
+        }
+
+
+class CastTrace:
+
+    def __init__(self, uri, received=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.uri = uri
+        self.started = time.time()
+        now = time.monotonic()
+        self.marks = {'soap_received': now if received is None else received,
+                      'dispatched': now}
+
+    def mark(self, stage):
+        """Record the first time of stage
+        :return: True if it is recorded
+        """
+        if stage in self.marks:
+            return False
+        self.marks[stage] = time.monotonic()
+        return True
+
+    def is_timeout(self):
+        return time.monotonic() - self.marks['soap_received'] > TRACE_TIMEOUT
+
+    def get_stages(self):
+        """Latency (ms) of each recorded stage from the previous recorded one
+        """
+        stages = {}
+        last = None
+        for stage in STAGES:
+            if stage not in self.marks:
+                continue
+            if last is not None:
+                stages[stage] = round((self.marks[stage] - last) * 1000, 1)
+            last = self.marks[stage]
+        return stages
+
+    def get_total(self):
+        return round((max(self.marks.values()) - self.marks['soap_received']) * 1000, 1)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'uri': self.uri,
+            'started': self.started,
+            'complete': STAGES[-1] in self.marks,
+            'stages': self.get_stages(),
+            'total': self.get_total()
+        }
+
+
+class CastTracer:
+    """Collect latency of the recent casts, see also: server.py -> class Service
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None
+        self.traces = collections.deque(maxlen=TRACE_HISTORY)
+        self.histograms = {stage: Histogram() for stage in STAGES[1:] + ['total']}
+
+    def begin(self, uri, received=None):
+        """Start tracing a new cast, the unfinished one is archived
+        :param uri: media uri
+        :param received: time.monotonic() when the SOAP request was received
+        """
+        with self.lock:
+            self.archive()
+            self.current = CastTrace(uri, received)
+            logger.debug("cast {} begin: {}".format(self.current.id, uri))
+
+    def mark(self, stage):
+        """Record a stage of the current cast
+        :param stage: one of STAGES
+        """
+        with self.lock:
+            trace = self.current
+            if trace is None:
+                return
+            if trace.is_timeout():
+                self.archive()
+                return
+            # PLAYING may be reported by the Play action before the first frame
+            if stage == STAGES[-1] and STAGES[-2] not in trace.marks:
+                return
+            if not trace.mark(stage):
+                return
+            if stage == STAGES[-1]:
+                self.archive()
+
+    def archive(self):
+        """Move the current trace into history, called with self.lock held
+        """
+        trace, self.current = self.current, None
+        if trace is None:
+            return
+        stages = trace.get_stages()
+        for stage, ms in stages.items():
+            self.histograms[stage].add(ms)
+        if STAGES[-1] in stages:
+            self.histograms['total'].add(trace.get_total())
+        self.traces.append(trace)
+        logger.info("cast {} latency: {}".format(trace.id, stages))
+
+    def get_info(self):
+        with self.lock:
+            traces = list(self.traces)
+            if self.current is not None:
+                traces.append(self.current)
+            return {
+                'stages': STAGES,
+                'histograms': {k: v.to_dict() for k, v in self.histograms.items()},
+                'traces': [trace.to_dict() for trace in traces]
+            }
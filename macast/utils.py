@@ -5,12 +5,14 @@ import sys
 import uuid
 import json
 import time
+import atexit
 import ctypes
 import appdirs
 import logging
 import platform
 import locale
 import cherrypy
+import threading
 import subprocess
 from enum import Enum
 import netifaces as ni
@@ -26,6 +28,8 @@ DEFAULT_PORT = 0
 SETTING_DIR = appdirs.user_config_dir('Macast', 'xfangfang')
 PROTOCOL_DIR = 'protocol'
 RENDERER_DIR = 'renderer'
+# seconds, changes of settings in this time are written to disk at once
+SETTING_SAVE_DELAY = 1
 
 
 class SettingProperty(Enum):
@@ -39,6 +43,10 @@ class SettingProperty(Enum):
     Macast_Protocol = 7
     Blocked_Interfaces = 8
     Additional_Interfaces = 9
+    MediaProxy = 10
+    MediaProxy_CacheSize = 11  # MB
+    HLSPrefetch = 12
+    HLSPrefetch_Segments = 13
 
 
 class Setting:
@@ -50,15 +58,60 @@ class Setting:
     friendly_name = "Macast({})".format(platform.node())
     temp_friendly_name = None
     mpv_default_path = 'mpv'
+    dirty = False  # there are changes not written to disk
+    save_timer = None
+    lock = threading.RLock()  # protect setting, dirty and save_timer
+    write_lock = threading.Lock()
 
     @staticmethod
     def save():
-        """Save user settings
+        """Save user settings now
+        The file is written to a temporary file first and then renamed,
+        so it is never left half written.
+        The snapshot is taken while holding write_lock, so an older snapshot
+        can never be written over a newer one.
         """
-        if not os.path.exists(SETTING_DIR):
-            os.makedirs(SETTING_DIR)
-        with open(Setting.setting_path, "w") as f:
-            json.dump(obj=Setting.setting, fp=f, sort_keys=True, indent=4)
+        with Setting.write_lock:
+            with Setting.lock:
+                if Setting.save_timer is not None:
+                    Setting.save_timer.cancel()
+                    Setting.save_timer = None
+                data = json.dumps(obj=Setting.setting, sort_keys=True, indent=4)
+                Setting.dirty = False
+            if not os.path.exists(SETTING_DIR):
+                os.makedirs(SETTING_DIR)
+            temp_path = Setting.setting_path + '.tmp'
+            try:
+                with open(temp_path, "w") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, Setting.setting_path)
+            except OSError as e:
+                logger.error("save setting error: {}".format(e))
+                with Setting.lock:
+                    Setting.dirty = True
+
+    @staticmethod
+    def save_later():
+        """Save user settings after SETTING_SAVE_DELAY,
+        so that a series of changes is written to disk once
+        """
+        with Setting.lock:
+            Setting.dirty = True
+            if Setting.save_timer is not None:
+                return
+            Setting.save_timer = threading.Timer(SETTING_SAVE_DELAY, Setting.save)
+            Setting.save_timer.name = "SETTING_SAVE_THREAD"
+            Setting.save_timer.daemon = True
+            Setting.save_timer.start()
+
+    @staticmethod
+    def flush():
+        """Write pending changes, called before exiting or restarting
+        """
+        if Setting.dirty:
+            Setting.save()
 
     @staticmethod
     def load():
@@ -201,17 +254,24 @@ class Setting:
         """
         if not bool(Setting.setting):
             Setting.load()
-        if property.name in Setting.setting:
-            return Setting.setting[property.name]
-        Setting.setting[property.name] = default
+        with Setting.lock:
+            if property.name in Setting.setting:
+                return Setting.setting[property.name]
+            # defaults are saved too, so they can be found in the setting file
+            Setting.setting[property.name] = default
+        Setting.save_later()
         return default
 
     @staticmethod
     def set(property, data):
-        """Set application settings
+        """Set application settings, it is written to disk in background
+        see also: Setting.save_later
         """
-        Setting.setting[property.name] = data
-        Setting.save()
+        with Setting.lock:
+            if property.name in Setting.setting and Setting.setting[property.name] == data:
+                return
+            Setting.setting[property.name] = data
+        Setting.save_later()
 
     @staticmethod
     def system_shell(shell):
@@ -344,6 +404,8 @@ class Setting:
 
     @staticmethod
     def restart():
+        # exec does not run atexit
+        Setting.flush()
         if sys.platform == 'darwin' and sys.executable.endswith("Contents/MacOS/python"):
             # run from py2app build
             Setting.stop_service()
@@ -359,6 +421,9 @@ class Setting:
             cherrypy.engine.restart()
 
 
+atexit.register(Setting.flush)
+
+
 class XMLPath(Enum):
     BASE_PATH = os.path.dirname(__file__)
     DESCRIPTION = BASE_PATH + '/xml/Description.xml'
@@ -428,3 +493,45 @@ def cherrypy_publish(method, default=None):
     if len(res) > 0:
         return res.pop()
     return default
+
+
+class LazySession:
+    """A requests.Session created on first use,
+    so that requests is not imported during startup
+    """
+
+    def __init__(self):
+        self._session = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    self._session = requests.Session()
+        return getattr(self._session, name)
+
+
+class BusCache:
+    """Cached result of cherrypy_publish(channel), eg: get_protocol
+    The bus is only published again after the channel is invalidated,
+    see also: plugin.py -> class ProtocolPlugin, class RendererPlugin
+    """
+    versions = {}  # channel -> version, increased by invalidate
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.value = None
+        self.version = None
+
+    def get(self):
+        version = BusCache.versions.get(self.channel, 0)
+        if self.value is None or self.version != version:
+            self.value = cherrypy_publish(self.channel)
+            self.version = version
+        return self.value
+
+    @staticmethod
+    def invalidate(channel):
+        BusCache.versions[channel] = BusCache.versions.get(channel, 0) + 1
@@ -0,0 +1,126 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Renderer benchmark
+# Compare MPVRenderer (json ipc) and LibMPVRenderer (in process) side by side,
+# both are running headless with --vo=null --ao=null:
+#   python -m macast_renderer.benchmark [--media URL] [--seconds 30] [--requests 500]
+# Reported for each renderer:
+#   command latency of get_property / set_property round trips (ms)
+#   cpu seconds per hour of playback, of Macast and of the mpv process
+
+import os
+import sys
+import time
+import argparse
+import logging
+
+from macast_renderer.mpv import MPVRenderer
+from macast_renderer.libmpv import LibMPVRenderer
+
+# a generated video, no media file is needed
+DEFAULT_MEDIA = 'av://lavfi:testsrc2=size=1280x720:rate=30'
+
+
+class HeadlessMPVRenderer(MPVRenderer):
+
+    def build_params(self, sock):
+        return super(HeadlessMPVRenderer, self).build_params(sock) + ['--vo=null', '--ao=null']
+
+
+def process_cpu(pid):
+    """cpu seconds used by another process, only available on linux
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def measure_latency(renderer, requests):
+    """Round trip time (ms) of get_property and set_property
+    """
+    res = {}
+    for name, command in [('get_property', lambda i: ['get_property', 'volume']),
+                          ('set_property', lambda i: ['set_property', 'volume', 50 + i % 2])]:
+        samples = []
+        for i in range(requests):
+            start = time.perf_counter()
+            renderer.send_request(command(i)).result(5)
+            samples.append((time.perf_counter() - start) * 1000)
+        res[name] = {
+            'avg': round(sum(samples) / len(samples), 3),
+            'p50': round(percentile(samples, 0.5), 3),
+            'p95': round(percentile(samples, 0.95), 3),
+        }
+    return res
+
+
+def measure_cpu(renderer, seconds):
+    """cpu seconds per hour of playback
+    """
+    proc = getattr(renderer, 'proc', None)
+    pid = proc.pid if proc is not None else None  # LibMPVRenderer has no mpv process
+    mpv_start = process_cpu(pid) if pid else None
+    start = time.process_time()
+    time.sleep(seconds)
+    scale = 3600 / seconds
+    res = {'macast': round((time.process_time() - start) * scale, 1)}
+    if mpv_start is not None:
+        mpv_end = process_cpu(pid)
+        if mpv_end is not None:
+            res['mpv'] = round((mpv_end - mpv_start) * scale, 1)
+    return res
+
+
+def run(renderer, media, seconds, requests):
+    renderer.start()
+    try:
+        if not renderer.ensure_mpv():
+            return {'error': 'mpv is not ready'}
+        renderer.set_media_url(media)
+        deadline = time.monotonic() + 10
+        while renderer.session is None or renderer.session.first_frame is None:
+            if time.monotonic() > deadline:
+                return {'error': 'cannot play {}'.format(media)}
+            time.sleep(0.05)
+        return {
+            'time_to_first_frame': round(renderer.session.first_frame, 3),
+            'latency_ms': measure_latency(renderer, requests),
+            'cpu_seconds_per_hour': measure_cpu(renderer, seconds),
+        }
+    finally:
+        renderer.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mpv renderers of Macast')
+    parser.add_argument('--media', default=DEFAULT_MEDIA)
+    parser.add_argument('--seconds', type=float, default=30, help='playback time for measuring cpu')
+    parser.add_argument('--requests', type=int, default=500, help='round trips for measuring latency')
+    parser.add_argument('--mpv', default='mpv', help='path of mpv')
+    parser.add_argument('--libmpv', default=None, help='path of libmpv')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    renderers = [
+        ('ipc', lambda: HeadlessMPVRenderer(path=args.mpv)),
+        ('libmpv', lambda: LibMPVRenderer(path=args.libmpv, options={'vo': 'null', 'ao': 'null'})),
+    ]
+    for name, create in renderers:
+        try:
+            res = run(create(), args.media, args.seconds, args.requests)
+        except Exception as e:
+            res = {'error': str(e)}
+        print('{:<8}{}'.format(name, res))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
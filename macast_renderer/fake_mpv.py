@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# Fake mpv
+# A pure python stand-in for mpv, speaking the JSON IPC protocol on a unix socket,
+# so MPVRenderer can be run and benchmarked on machines without mpv or a display:
+#   MPVRenderer(path='macast_renderer/fake_mpv.py')
+# Only the standard library is used, it is started by MPVRenderer like mpv.
+# Timing is scripted by environment variables (seconds):
+#   MACAST_FAKE_MPV_LATENCY    delay before every reply           default 0
+#   MACAST_FAKE_MPV_FRAGMENT   max bytes per write, 0 means no limit  default 0
+#   MACAST_FAKE_MPV_LOAD_TIME  from start-file to playback-restart  default 0.2
+#   MACAST_FAKE_MPV_SEEK_TIME  from seek to playback-restart      default 0.05
+#   MACAST_FAKE_MPV_DURATION   media duration, 0 means endless    default 0
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+
+def get_env(name, default):
+    try:
+        return float(os.environ.get('MACAST_FAKE_MPV_{}'.format(name), default))
+    except ValueError:
+        return default
+
+
+LATENCY = get_env('LATENCY', 0)
+FRAGMENT = int(get_env('FRAGMENT', 0))
+LOAD_TIME = get_env('LOAD_TIME', 0.2)
+SEEK_TIME = get_env('SEEK_TIME', 0.05)
+DURATION = get_env('DURATION', 0)
+
+
+def parse_options(options):
+    """Parse per-file options of loadfile, eg: start=0,pause=yes
+    """
+    res = {}
+    for option in options.split(',') if options else []:
+        if '=' in option:
+            key, value = option.split('=', 1)
+            res[key] = value
+    return res
+
+
+class Client:
+
+    def __init__(self, player, conn):
+        self.player = player
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.observed = {}  # property name -> observe ids
+
+    def send(self, msg):
+        data = (json.dumps(msg) + '\n').encode()
+        try:
+            with self.lock:
+                if FRAGMENT <= 0:
+                    self.conn.sendall(data)
+                    return
+                for i in range(0, len(data), FRAGMENT):
+                    self.conn.sendall(data[i:i + FRAGMENT])
+                    time.sleep(0.001)
+        except OSError:
+            pass
+
+    def run(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.conn.recv(65536)
+            except OSError:
+                break
+            if data == b'':
+                break
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                if line.strip():
+                    self.handle(line)
+        self.player.remove_client(self)
+        self.conn.close()
+
+    def handle(self, line):
+        try:
+            msg = json.loads(line)
+            command = msg['command']
+        except Exception:
+            self.send({'error': 'invalid parameter'})
+            return
+        if LATENCY > 0:
+            time.sleep(LATENCY)
+        error, data = self.player.command(self, command)
+        reply = {'error': error, 'data': data}
+        if 'request_id' in msg:
+            reply['request_id'] = msg['request_id']
+        self.send(reply)
+
+
+class FakeMPV:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.clients = []
+        self.running = True
+        self.generation = 0  # timers of replaced files are ignored
+        self.playlist = []  # urls appended after the playing one
+        self.playing = None
+        self.options = {}  # per-file options of the playing url
+        self.position = 0.0
+        self.position_anchor = time.monotonic()
+        self.properties = {
+            'volume': 100,
+            'pause': False,
+            'mute': False,
+            'duration': None,
+            'track-list': [],
+            'speed': 1.0,
+            'sub-visibility': True,
+            'paused-for-cache': False,
+            'cache-speed': 0,
+            'demuxer-cache-duration': 0,
+            'frame-drop-count': 0,
+            'hwdec-current': 'no',
+            'title': 'Macast',
+            'idle-active': True,
+        }
+
+    def get_position(self):
+        if self.playing is None or self.properties['pause']:
+            return self.position
+        elapsed = time.monotonic() - self.position_anchor
+        return self.position + elapsed * float(self.properties['speed'])
+
+    def set_position(self, position):
+        self.position = position
+        self.position_anchor = time.monotonic()
+
+    def get_property(self, name):
+        if name in ['time-pos', 'playback-time']:
+            return ('success', self.get_position()) if self.playing else ('property unavailable', None)
+        if name in self.properties:
+            return 'success', self.properties[name]
+        return 'property not found', None
+
+    def set_property(self, name, value):
+        if name in ['time-pos', 'playback-time']:
+            self.set_position(float(value))
+            return
+        if name == 'pause':
+            # keep position while changing the clock
+            self.set_position(self.get_position())
+            value = value in [True, 'yes']
+        self.properties[name] = value
+        self.notify_property(name)
+
+    def notify_property(self, name):
+        for client in list(self.clients):
+            for observe_id in client.observed.get(name, []):
+                client.send({'event': 'property-change', 'id': observe_id,
+                             'name': name, 'data': self.properties.get(name, None)})
+
+    def emit(self, event, **kwargs):
+        msg = {'event': event}
+        msg.update(kwargs)
+        for client in list(self.clients):
+            client.send(msg)
+
+    def later(self, delay, fun, *args):
+        """Run fun after delay, if no other file is loaded in the meantime
+        """
+        generation = self.generation
+
+        def run():
+            with self.lock:
+                if self.running and generation == self.generation:
+                    fun(*args)
+
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+
+    def command(self, client, command):
+        name = command[0] if command else ''
+        args = command[1:]
+        with self.lock:
+            if name == 'get_property':
+                return self.get_property(args[0])
+            if name == 'set_property':
+                self.set_property(args[0], args[1])
+            elif name == 'observe_property':
+                observe_id, prop = args[0], args[1]
+                client.observed.setdefault(prop, []).append(observe_id)
+                client.send({'event': 'property-change', 'id': observe_id,
+                             'name': prop, 'data': self.properties.get(prop, None)})
+            elif name == 'loadfile':
+                mode = args[1] if len(args) > 1 else 'replace'
+                options = parse_options(args[2] if len(args) > 2 else '')
+                if mode == 'append' or (mode == 'append-play' and self.playing):
+                    self.playlist.append((args[0], options))
+                else:
+                    self.playlist = []
+                    self.load(args[0], options)
+            elif name == 'playlist-clear':
+                self.playlist = []
+            elif name == 'stop':
+                self.playlist = []
+                self.end_file('stop')
+            elif name == 'seek':
+                if self.playing is None:
+                    return 'error running command', None
+                position = float(args[0]) if ':' not in str(args[0]) else \
+                    sum(float(i) * 60 ** n for n, i in enumerate(reversed(str(args[0]).split(':'))))
+                if len(args) < 2 or args[1] != 'absolute':
+                    position += self.get_position()
+                self.set_position(max(position, 0))
+                self.emit('seek')
+                self.later(SEEK_TIME, self.emit, 'playback-restart')
+            elif name == 'quit':
+                self.running = False
+                threading.Thread(target=self.quit, daemon=True).start()
+        return 'success', None
+
+    def load(self, url, options):
+        if self.playing is not None:
+            self.end_file('stop', idle=False)
+        self.generation += 1
+        self.playing = url
+        self.options = options
+        self.properties['idle-active'] = False
+        self.emit('start-file', playlist_entry_id=self.generation)
+        if options.get('pause', None) == 'yes':
+            self.set_property('pause', True)
+        start = options.get('start', '0')
+        self.set_position(float(start) if start.replace('.', '', 1).isdigit() else 0.0)
+        self.later(LOAD_TIME, self.loaded)
+
+    def loaded(self):
+        self.properties['duration'] = DURATION if DURATION > 0 else None
+        self.properties['track-list'] = [{'id': 1, 'type': 'video', 'selected': True}]
+        self.notify_property('duration')
+        self.notify_property('track-list')
+        self.emit('file-loaded')
+        self.set_position(self.position)
+        self.emit('playback-restart')
+        if DURATION > 0:
+            self.later(max(DURATION - self.position, 0), self.end_file, 'eof')
+
+    def end_file(self, reason, idle=True):
+        if self.playing is None:
+            return
+        self.generation += 1
+        self.playing = None
+        self.properties['duration'] = None
+        self.set_position(0)
+        self.emit('end-file', reason=reason)
+        if reason == 'eof' and self.playlist:
+            url, options = self.playlist.pop(0)
+            self.load(url, options)
+        elif idle:
+            self.properties['idle-active'] = True
+            self.emit('idle')
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def quit(self):
+        self.emit('shutdown')
+        for client in list(self.clients):
+            try:
+                client.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        os._exit(0)
+
+    def serve(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(8)
+        try:
+            while self.running:
+                conn, _ = server.accept()
+                client = Client(self, conn)
+                with self.lock:
+                    self.clients.append(client)
+                threading.Thread(target=client.run, daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def main(argv):
+    path = None
+    for arg in argv:
+        if arg.startswith('--input-ipc-server='):
+            path = arg.split('=', 1)[1]
+    if path is None or os.name == 'nt':
+        sys.stderr.write('fake mpv: --input-ipc-server=<unix socket> is required\n')
+        return 1
+    sys.stderr.write('fake mpv: listening on {}\n'.format(path))
+    sys.stderr.flush()
+    FakeMPV(path).serve()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,433 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# <macast.title>LibMPV Renderer</macast.title>
+# <macast.renderer>LibMPVRenderer</macast.renderer>
+# <macast.platform>linux,win32</macast.platform>
+# <macast.version>0.1</macast.version>
+# <macast.author>xfangfang</macast.author>
+# <macast.desc>In-process mpv through libmpv, no JSON IPC.</macast.desc>
+#
+# LibMPV Renderer
+# MPVRenderer running mpv inside Macast through libmpv (ctypes),
+# commands and properties are passed natively instead of JSON over ipc,
+# and property changes are read from the event queue of mpv.
+# Headless usage: LibMPVRenderer(options={'vo': 'null', 'ao': 'null'})
+
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import locale
+import logging
+import threading
+import cherrypy
+import gettext
+
+from macast_renderer.mpv import MPVRenderer
+
+logger = logging.getLogger("LibMPVRenderer")
+logger.setLevel(logging.INFO)
+
+MPV_FORMAT_NONE = 0
+MPV_FORMAT_STRING = 1
+MPV_FORMAT_FLAG = 3
+MPV_FORMAT_INT64 = 4
+MPV_FORMAT_DOUBLE = 5
+MPV_FORMAT_NODE = 6
+MPV_FORMAT_NODE_ARRAY = 7
+MPV_FORMAT_NODE_MAP = 8
+
+MPV_EVENT_NONE = 0
+MPV_EVENT_SHUTDOWN = 1
+MPV_EVENT_LOG_MESSAGE = 2
+MPV_EVENT_START_FILE = 6
+MPV_EVENT_END_FILE = 7
+MPV_EVENT_PLAYBACK_RESTART = 21
+MPV_EVENT_PROPERTY_CHANGE = 22
+
+# mpv_end_file_reason -> reason of end-file event in json ipc
+END_FILE_REASONS = {0: 'eof', 2: 'stop', 3: 'quit', 4: 'error', 5: 'redirect'}
+# idle event of mpv is deprecated, idle-active is observed instead
+IDLE_OBSERVE_ID = 1000
+# seconds to wait for the reloaded media to play
+RELOAD_TIMEOUT = 10
+
+LIBMPV_NAMES = {
+    'win32': ['mpv-2.dll', 'libmpv-2.dll', 'mpv-1.dll'],
+    'darwin': ['libmpv.dylib', 'libmpv.2.dylib', 'libmpv.1.dylib'],
+}
+
+
+class MpvNodeList(ctypes.Structure):
+    pass
+
+
+class MpvNodeUnion(ctypes.Union):
+    _fields_ = [('string', ctypes.c_char_p),
+                ('flag', ctypes.c_int),
+                ('int64', ctypes.c_int64),
+                ('double_', ctypes.c_double),
+                ('list', ctypes.POINTER(MpvNodeList))]
+
+
+class MpvNode(ctypes.Structure):
+    _fields_ = [('u', MpvNodeUnion),
+                ('format', ctypes.c_int)]
+
+
+MpvNodeList._fields_ = [('num', ctypes.c_int),
+                        ('values', ctypes.POINTER(MpvNode)),
+                        ('keys', ctypes.POINTER(ctypes.c_char_p))]
+
+
+class MpvEvent(ctypes.Structure):
+    _fields_ = [('event_id', ctypes.c_int),
+                ('error', ctypes.c_int),
+                ('reply_userdata', ctypes.c_uint64),
+                ('data', ctypes.c_void_p)]
+
+
+class MpvEventProperty(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_char_p),
+                ('format', ctypes.c_int),
+                ('data', ctypes.c_void_p)]
+
+
+class MpvEventEndFile(ctypes.Structure):
+    _fields_ = [('reason', ctypes.c_int),
+                ('error', ctypes.c_int)]
+
+
+class MpvEventLogMessage(ctypes.Structure):
+    _fields_ = [('prefix', ctypes.c_char_p),
+                ('level', ctypes.c_char_p),
+                ('text', ctypes.c_char_p)]
+
+
+def load_libmpv(path=None):
+    """Load libmpv and declare the functions used by LibMPVRenderer
+    :param path: path of libmpv, searched in system library path if None
+    """
+    names = [path] if path else \
+        [ctypes.util.find_library('mpv')] + LIBMPV_NAMES.get(sys.platform, ['libmpv.so.2', 'libmpv.so.1'])
+    lib = None
+    for name in filter(None, names):
+        try:
+            lib = ctypes.CDLL(name)
+            break
+        except OSError:
+            continue
+    if lib is None:
+        raise OSError("cannot find libmpv: {}".format(names))
+    handle = ctypes.c_void_p
+    lib.mpv_create.restype = handle
+    lib.mpv_initialize.argtypes = [handle]
+    lib.mpv_terminate_destroy.argtypes = [handle]
+    lib.mpv_wakeup.argtypes = [handle]
+    lib.mpv_error_string.restype = ctypes.c_char_p
+    lib.mpv_error_string.argtypes = [ctypes.c_int]
+    lib.mpv_set_option_string.argtypes = [handle, ctypes.c_char_p, ctypes.c_char_p]
+    lib.mpv_command.argtypes = [handle, ctypes.POINTER(ctypes.c_char_p)]
+    lib.mpv_set_property.argtypes = [handle, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
+    lib.mpv_set_property_string.argtypes = [handle, ctypes.c_char_p, ctypes.c_char_p]
+    lib.mpv_get_property.argtypes = [handle, ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
+    lib.mpv_free_node_contents.argtypes = [ctypes.POINTER(MpvNode)]
+    lib.mpv_observe_property.argtypes = [handle, ctypes.c_uint64, ctypes.c_char_p, ctypes.c_int]
+    lib.mpv_request_log_messages.argtypes = [handle, ctypes.c_char_p]
+    lib.mpv_wait_event.restype = ctypes.POINTER(MpvEvent)
+    lib.mpv_wait_event.argtypes = [handle, ctypes.c_double]
+    return lib
+
+
+def node_to_python(node):
+    """Convert mpv_node to python value, same as the data in json ipc
+    """
+    fmt = node.format
+    if fmt == MPV_FORMAT_STRING:
+        return node.u.string.decode('utf-8', errors='replace')
+    if fmt == MPV_FORMAT_FLAG:
+        return bool(node.u.flag)
+    if fmt == MPV_FORMAT_INT64:
+        return node.u.int64
+    if fmt == MPV_FORMAT_DOUBLE:
+        return node.u.double_
+    if fmt == MPV_FORMAT_NODE_ARRAY:
+        values = node.u.list.contents
+        return [node_to_python(values.values[i]) for i in range(values.num)]
+    if fmt == MPV_FORMAT_NODE_MAP:
+        values = node.u.list.contents
+        return {values.keys[i].decode(): node_to_python(values.values[i]) for i in range(values.num)}
+    return None
+
+
+def params_to_options(params):
+    """Convert mpv command line parameters to libmpv options
+    :param params: eg: ['--idle=yes', '--ontop', '--no-terminal']
+    :return: dict
+    """
+    options = {}
+    scripts = []
+    for param in params:
+        if not param.startswith('--'):
+            continue
+        name, sep, value = param[2:].partition('=')
+        if not sep:
+            if name.startswith('no-'):
+                name, value = name[3:], 'no'
+            else:
+                value = 'yes'
+        if name == 'input-ipc-server':
+            continue
+        if name == 'script':
+            scripts.append(value)
+            continue
+        options[name] = value
+    if scripts:
+        options['scripts'] = os.pathsep.join(scripts)
+    return options
+
+
+class LibMPVRenderer(MPVRenderer):
+    """MPVRenderer with mpv running in process
+    Only the transport is replaced: write_ipc runs commands through libmpv,
+    and MPV_EVENT_THREAD feeds events to the handlers of MPVRenderer.
+    """
+    # on darwin the video output of libmpv must run on the main thread,
+    # which is taken by the menu bar app
+    support_platform = {'linux', 'win32'}
+
+    def __init__(self, lang=gettext.gettext, path=None, options=None):
+        """
+        :param path: path of libmpv
+        :param options: extra mpv options, eg: {'vo': 'null', 'ao': 'null'}
+        """
+        super(LibMPVRenderer, self).__init__(lang, 'libmpv')
+        self.library = path
+        self.lib = None
+        self.handle = None
+        self.options = options if options is not None else {}
+        self.event_thread = None
+        self.handover_restart = threading.Event()  # set by playback-restart while reloading
+
+    def build_options(self):
+        # libmpv disables the osc and key bindings by default
+        options = {'osc': 'yes',
+                   'input-default-bindings': 'yes',
+                   'input-vo-keyboard': 'yes'}
+        options.update(params_to_options(self.build_params(None)[1:]))
+        # messages are received by mpv_request_log_messages, not from stderr
+        options['terminal'] = 'no'
+        options.update(self.options)
+        return options
+
+    def check(self, error):
+        if error < 0:
+            return self.lib.mpv_error_string(error).decode()
+        return 'success'
+
+    def spawn(self):
+        """Create mpv in process and start the event thread
+        """
+        logger.info("starting libmpv")
+        start = time.monotonic()
+        if self.lib is None:
+            self.lib = load_libmpv(self.library)
+        # libmpv only works with C numeric locale
+        locale.setlocale(locale.LC_NUMERIC, 'C')
+        handle = self.lib.mpv_create()
+        if not handle:
+            logger.error("cannot create mpv")
+            return
+        for name, value in self.build_options().items():
+            error = self.lib.mpv_set_option_string(handle, name.encode(), str(value).encode())
+            if error < 0:
+                logger.error("mpv option {}={}: {}".format(name, value, self.check(error)))
+        self.lib.mpv_request_log_messages(handle, b'warn')
+        error = self.lib.mpv_initialize(handle)
+        if error < 0:
+            logger.error("cannot initialize mpv: {}".format(self.check(error)))
+            self.lib.mpv_terminate_destroy(handle)
+            cherrypy.engine.publish("app_notify", "Macast", "MPV Can't start")
+            return
+        self.handle = handle
+        self.mpv_running = True
+        self.ipc_once_connected = True
+        self.ready_latency = time.monotonic() - start
+        logger.info("libmpv ready in {:.3f}s".format(self.ready_latency))
+        cherrypy.engine.publish('mpv_ready_latency', self.ready_latency)
+        self.event_thread = threading.Thread(target=self.run_events, args=(handle,),
+                                             daemon=True, name="MPV_EVENT_THREAD")
+        self.event_thread.start()
+        self.ipc_ready.set()
+        cherrypy.engine.publish('mpvipc_start')
+        cherrypy.engine.publish('renderer_start')
+        self.set_observe()
+        with self.command_lock:
+            if self.handle is handle:
+                self.lib.mpv_observe_property(handle, IDLE_OBSERVE_ID, b'idle-active', MPV_FORMAT_FLAG)
+
+    def shutdown(self):
+        """Destroy mpv and stop the event thread
+        """
+        logger.info("stopping libmpv")
+        self.mpv_running = False
+        self.ipc_ready.clear()
+        # no command runs with the handle after it is taken here
+        with self.command_lock:
+            handle, self.handle = self.handle, None
+        if handle is None:
+            return
+        self.lib.mpv_wakeup(handle)
+        if self.event_thread is not None and self.event_thread is not threading.current_thread():
+            self.event_thread.join()
+        with self.command_lock:
+            self.lib.mpv_terminate_destroy(handle)
+        self.cancel_requests()
+
+    def reload_standby(self):
+        """Recreate mpv with new settings and continue playing
+        There is no standby player in process, the media is reloaded at the same position.
+        """
+        if not self.running or not self.mpv_running:
+            return
+        uri = self.protocol.get_state_url()
+        transport_state = self.protocol.get_state_transport_state()
+        resume = transport_state == 'PLAYING'
+        position = self.get_property('time-pos', self.interpolate_position())
+        with self.spawn_lock:
+            start = time.monotonic()
+            # events of the new mpv are ignored until the media is reloaded
+            self.handover = (start, resume, start)
+            self.shutdown()
+            self.spawn()
+        if uri and transport_state in ['PLAYING', 'PAUSED_PLAYBACK']:
+            # per-file options are applied when the file starts, after any
+            # command sent now, so the pause state is decided here
+            options = {'start': position, 'pause': 'no' if resume else 'yes'}
+            options.update(self.get_media_profile(self.media_class))
+            commands = [['loadfile', uri, 'replace',
+                         ','.join([f'{i}={options[i]}' for i in options])],
+                        ['set_property', 'title', self.title]]
+            if self.next_url is not None:
+                # the playlist of the destroyed mpv is lost, the next media is queued again
+                commands.append(self.next_url_command())
+            self.handover_restart.clear()
+            self.send_commands(commands)
+            # the downtime lasts until the media plays again
+            if not self.handover_restart.wait(RELOAD_TIMEOUT):
+                logger.error("libmpv cannot reload {}".format(uri))
+        self.finish_handover()
+
+    def on_playback_restart(self, res):
+        if self.handover is not None:
+            self.handover_restart.set()
+        super(LibMPVRenderer, self).on_playback_restart(res)
+
+    def write_ipc(self, msgs):
+        """Run several commands in libmpv, replies are resolved at once
+        The handle is only used while holding command_lock, so it cannot be
+        destroyed by shutdown in the middle of a command.
+        """
+        replies = []
+        with self.command_lock:
+            handle = self.handle
+            if handle is None or not self.ipc_ready.is_set():
+                logger.debug("libmpv is not running, drop: {}".format(msgs))
+                return False
+            for msg in msgs:
+                try:
+                    error, data = self.run_command(handle, msg['command'])
+                except Exception as e:
+                    error, data = str(e), None
+                if error != 'success':
+                    logger.debug("mpv command {}: {}".format(msg['command'], error))
+                if 'request_id' in msg:
+                    replies.append({'request_id': msg['request_id'], 'error': error, 'data': data})
+        for res in replies:
+            self.resolve_request(res)
+        return True
+
+    def run_command(self, handle, command):
+        """Run a command of json ipc with the native api of libmpv
+        :return: (error, data)
+        """
+        name = command[0]
+        if name == 'get_property':
+            node = MpvNode()
+            error = self.lib.mpv_get_property(handle, command[1].encode(),
+                                              MPV_FORMAT_NODE, ctypes.byref(node))
+            if error < 0:
+                return self.check(error), None
+            data = node_to_python(node)
+            self.lib.mpv_free_node_contents(ctypes.byref(node))
+            return 'success', data
+        if name == 'set_property':
+            return self.check(self.set_property(handle, command[1], command[2])), None
+        if name == 'observe_property':
+            return self.check(self.lib.mpv_observe_property(
+                handle, command[1], command[2].encode(), MPV_FORMAT_NODE)), None
+        args = [('yes' if i else 'no') if isinstance(i, bool) else str(i) for i in command]
+        argv = (ctypes.c_char_p * (len(args) + 1))(*[i.encode() for i in args], None)
+        return self.check(self.lib.mpv_command(handle, argv)), None
+
+    def set_property(self, handle, name, value):
+        if isinstance(value, bool):
+            data, fmt = ctypes.c_int(int(value)), MPV_FORMAT_FLAG
+        elif isinstance(value, int):
+            data, fmt = ctypes.c_int64(value), MPV_FORMAT_INT64
+        elif isinstance(value, float):
+            data, fmt = ctypes.c_double(value), MPV_FORMAT_DOUBLE
+        else:
+            return self.lib.mpv_set_property_string(handle, name.encode(), str(value).encode())
+        return self.lib.mpv_set_property(handle, name.encode(), fmt, ctypes.byref(data))
+
+    def run_events(self, handle):
+        """Read the event queue of mpv until it is destroyed
+        The events are passed to the same handlers used by json ipc.
+        """
+        while self.mpv_running:
+            event = self.lib.mpv_wait_event(handle, -1).contents
+            event_id = event.event_id
+            if event_id == MPV_EVENT_SHUTDOWN:
+                break
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error("mpv event {}: {}".format(event_id, e))
+        logger.info("libmpv event thread stopped")
+
+    def on_event(self, event):
+        event_id = event.event_id
+        if event_id == MPV_EVENT_PROPERTY_CHANGE:
+            prop = ctypes.cast(event.data, ctypes.POINTER(MpvEventProperty)).contents
+            data = None
+            if prop.format == MPV_FORMAT_NODE:
+                data = node_to_python(ctypes.cast(prop.data, ctypes.POINTER(MpvNode)).contents)
+            elif prop.format == MPV_FORMAT_FLAG:
+                data = bool(ctypes.cast(prop.data, ctypes.POINTER(ctypes.c_int)).contents.value)
+            if event.reply_userdata == IDLE_OBSERVE_ID:
+                if data:
+                    self.on_idle({'event': 'idle'})
+                return
+            handler = self.observe_handlers.get(event.reply_userdata, None)
+            if handler is not None:
+                handler(data)
+        elif event_id == MPV_EVENT_START_FILE:
+            self.on_start_file({'event': 'start-file'})
+        elif event_id == MPV_EVENT_END_FILE:
+            end_file = ctypes.cast(event.data, ctypes.POINTER(MpvEventEndFile)).contents
+            res = {'event': 'end-file', 'reason': END_FILE_REASONS.get(end_file.reason, 'unknown')}
+            if end_file.error < 0:
+                res['file_error'] = self.check(end_file.error)
+            logger.info(res)
+            self.on_end_file(res)
+        elif event_id == MPV_EVENT_PLAYBACK_RESTART:
+            self.on_playback_restart({'event': 'playback-restart'})
+        elif event_id == MPV_EVENT_LOG_MESSAGE:
+            message = ctypes.cast(event.data, ctypes.POINTER(MpvEventLogMessage)).contents
+            line = '[{}] {}'.format(message.prefix.decode(),
+                                    message.text.decode('utf-8', errors='replace').rstrip())
+            self.stderr_lines.append(line)
+            self.log_stderr(line)
+
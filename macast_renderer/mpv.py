@@ -9,12 +9,15 @@ import json
 import time
 import socket
 import random
+import itertools
+import collections
 import subprocess
 import logging
 import threading
 import cherrypy
 import gettext
 from enum import Enum
+from concurrent.futures import Future
 
 from macast.utils import Setting
 from macast.renderer import Renderer, RendererSetting
@@ -27,6 +30,14 @@ if os.name == 'nt':
 logger = logging.getLogger("MPVRenderer")
 logger.setLevel(logging.INFO)
 
+# mpv ipc server is polled with exponential backoff until connectable
+IPC_RETRY_MIN = 0.005
+IPC_RETRY_MAX = 0.5
+# last lines of mpv output (stdout and stderr) kept for diagnostics
+STDERR_BUFFER_LINES = 200
+# at most these lines of mpv output are logged per second
+STDERR_LOG_RATE = 20
+
 
 class ObserveProperty(Enum):
     volume = 1
@@ -37,6 +48,309 @@ class ObserveProperty(Enum):
     track_list = 6
     speed = 7
     sub = 8
+    paused_for_cache = 9
+    cache_speed = 10
+    demuxer_cache_duration = 11
+    frame_drop = 12
+    hwdec = 13
+
+
+OBSERVED_PROPERTIES = {
+    # time-pos is not observed, mpv reports it on every frame.
+    # Position is tracked with a clock anchored by exact queries instead.
+    ObserveProperty.volume: 'volume',
+    ObserveProperty.pause: 'pause',
+    ObserveProperty.mute: 'mute',
+    ObserveProperty.duration: 'duration',
+    ObserveProperty.track_list: 'track-list',
+    ObserveProperty.speed: 'speed',
+    ObserveProperty.sub: 'sub-visibility',
+    ObserveProperty.paused_for_cache: 'paused-for-cache',
+    ObserveProperty.cache_speed: 'cache-speed',
+    ObserveProperty.demuxer_cache_duration: 'demuxer-cache-duration',
+    ObserveProperty.frame_drop: 'frame-drop-count',
+    ObserveProperty.hwdec: 'hwdec-current',
+}
+
+# Per-file mpv options for each media class (see Renderer.set_media_class),
+# they are passed with loadfile and reset by mpv when the file ends.
+MEDIA_PROFILES = {
+    # no window and no video decoding for audio, cover art is never decoded
+    'audio': {'vid': 'no', 'force-window': 'no',
+              'demuxer-max-bytes': '8MiB', 'demuxer-max-back-bytes': '2MiB'},
+    'image': {'hwdec': 'no', 'vd-lavc-threads': 1,
+              'demuxer-max-bytes': '16MiB', 'demuxer-max-back-bytes': 0},
+    'video': {},
+}
+
+# demuxer cache levels chosen by CacheTuner: (demuxer-max-bytes, cache-secs)
+CACHE_LEVELS = [('32MiB', 10), ('150MiB', 60), ('400MiB', 300), ('1024MiB', 600)]
+CACHE_DEFAULT_LEVEL = 1
+# seconds between two adjustments of the same stream
+CACHE_TUNE_INTERVAL = 10
+# rebuffering steps up sooner, but a burst of rebuffers only counts once
+CACHE_REBUFFER_COOLDOWN = 5
+CACHE_SPEED_SAMPLES = 20
+
+
+class CacheTuner:
+    """Choose the demuxer cache size of a stream from observed throughput
+    Bursty or slow sources get a bigger read-ahead, fast and steady sources
+    (usually LAN) get a smaller cache to save memory.
+    """
+
+    def __init__(self):
+        self.history = collections.deque(maxlen=20)  # last adjustments
+        self.level = CACHE_DEFAULT_LEVEL
+        self.speeds = collections.deque(maxlen=CACHE_SPEED_SAMPLES)
+        self.cache_duration = 0.0
+        self.cache_full = False
+        self.rebuffers = 0
+        self.changed = time.monotonic()
+
+    def reset(self):
+        """Start tuning a new stream
+        """
+        self.level = CACHE_DEFAULT_LEVEL
+        self.speeds.clear()
+        self.cache_duration = 0.0
+        self.cache_full = False
+        self.rebuffers = 0
+        self.changed = time.monotonic()
+
+    def get_options(self):
+        """mpv options of current level
+        """
+        max_bytes, cache_secs = CACHE_LEVELS[self.level]
+        return {'demuxer-max-bytes': max_bytes, 'cache-secs': cache_secs}
+
+    def get_speed(self):
+        """Get mean (bytes/s) and coefficient of variation of cache speed
+        """
+        if len(self.speeds) == 0:
+            return 0.0, 0.0
+        mean = sum(self.speeds) / len(self.speeds)
+        if mean == 0:
+            return 0.0, 0.0
+        variance = sum((i - mean) ** 2 for i in self.speeds) / len(self.speeds)
+        return mean, variance ** 0.5 / mean
+
+    def on_speed(self, speed):
+        """
+        :param speed: cache-speed of mpv, 0 while the cache is full
+        :return: new level or None
+        """
+        # mpv stops reading when the cache is full, zero is not a throughput
+        self.cache_full = speed == 0 and self.cache_duration > 0
+        if speed > 0:
+            self.speeds.append(speed)
+        return self.evaluate()
+
+    def on_duration(self, duration):
+        self.cache_duration = duration
+        return None
+
+    def on_rebuffer(self):
+        self.rebuffers += 1
+        if time.monotonic() - self.changed < CACHE_REBUFFER_COOLDOWN:
+            return None
+        return self.step(1, 'rebuffer')
+
+    def evaluate(self):
+        if time.monotonic() - self.changed < CACHE_TUNE_INTERVAL:
+            return None
+        if len(self.speeds) < CACHE_SPEED_SAMPLES // 4:
+            return None
+        _, variation = self.get_speed()
+        cache_secs = CACHE_LEVELS[self.level][1]
+        if variation > 1.0 and self.cache_duration < cache_secs / 2:
+            return self.step(1, 'bursty')
+        if self.rebuffers == 0 and variation < 0.5 and \
+                (self.cache_full or self.cache_duration >= cache_secs * 0.9):
+            return self.step(-1, 'steady')
+        return None
+
+    def step(self, direction, reason):
+        level = min(max(self.level + direction, 0), len(CACHE_LEVELS) - 1)
+        if level == self.level:
+            return None
+        self.level = level
+        self.changed = time.monotonic()
+        speed, variation = self.get_speed()
+        self.history.append({
+            'time': time.time(),
+            'level': level,
+            'reason': reason,
+            'speed': int(speed),
+            'variation': round(variation, 2),
+            'cache_duration': round(self.cache_duration, 1),
+            **self.get_options()
+        })
+        return level
+
+    def get_info(self):
+        speed, variation = self.get_speed()
+        return {
+            'level': self.level,
+            'options': self.get_options(),
+            'speed': int(speed),
+            'variation': round(variation, 2),
+            'cache_duration': round(self.cache_duration, 1),
+            'rebuffers': self.rebuffers,
+            'history': list(self.history),
+        }
+
+# finished playback sessions kept for /api?query=sessions
+SESSION_HISTORY = 50
+
+
+class PlaybackSession:
+    """QoS of playing one url, collected from the events of mpv
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.started = time.time()
+        self.start_time = time.monotonic()
+        self.first_frame = None  # seconds from loading to the first frame
+        self.rebuffers = 0
+        self.rebuffer_time = 0.0
+        self.rebuffer_start = None
+        self.dropped_frames = 0
+        self.speed_sum = 0.0
+        self.speed_samples = 0
+        self.speed_peak = 0.0
+        self.hwdec = None
+        self.seek_start = None
+        self.seeks = []  # seconds from seek command to playback restart
+        self.ended = None
+        self.end_reason = None
+
+    def on_playback_restart(self):
+        now = time.monotonic()
+        if self.first_frame is None:
+            self.first_frame = now - self.start_time
+        elif self.seek_start is not None:
+            self.seeks.append(now - self.seek_start)
+        self.seek_start = None
+
+    def on_paused_for_cache(self, paused):
+        now = time.monotonic()
+        if paused and self.rebuffer_start is None:
+            self.rebuffers += 1
+            self.rebuffer_start = now
+        elif not paused and self.rebuffer_start is not None:
+            self.rebuffer_time += now - self.rebuffer_start
+            self.rebuffer_start = None
+
+    def on_cache_speed(self, speed):
+        if speed > 0:
+            self.speed_sum += speed
+            self.speed_samples += 1
+            self.speed_peak = max(self.speed_peak, speed)
+
+    def finish(self, reason):
+        if self.ended is not None:
+            return
+        self.on_paused_for_cache(False)
+        self.ended = time.time()
+        self.end_reason = reason
+
+    def to_dict(self):
+        return {
+            'uri': self.uri,
+            'started': self.started,
+            'ended': self.ended,
+            'end_reason': self.end_reason,
+            'time_to_first_frame': self.first_frame,
+            'rebuffers': self.rebuffers,
+            'rebuffer_time': round(self.rebuffer_time, 3),
+            'dropped_frames': self.dropped_frames,
+            'cache_speed_avg': int(self.speed_sum / self.speed_samples) if self.speed_samples else 0,
+            'cache_speed_peak': int(self.speed_peak),
+            'hwdec': self.hwdec,
+            'seeks': len(self.seeks),
+            'seek_latency_avg': sum(self.seeks) / len(self.seeks) if self.seeks else None,
+            'seek_latency_max': max(self.seeks) if self.seeks else None,
+        }
+
+
+def format_time(sec):
+    """Convert seconds to string like 0:00:00
+    """
+    sec = int(sec)
+    return '%d:%02d:%02d' % (sec // 3600, (sec % 3600) // 60, sec % 60)
+
+
+def new_ipc_path():
+    mpv_rand = random.randint(0, 9999)
+    if os.name == 'nt':
+        return Setting.get_base_path(r"\\.\pipe\macast_mpvsocket{}".format(mpv_rand))
+    return '/tmp/macast_mpvsocket{}'.format(mpv_rand)
+
+
+def connect_ipc(path):
+    """Connect to the ipc server of mpv
+    :return: PipeConnection on windows, socket on others
+    """
+    if os.name == 'nt':
+        handler = _winapi.CreateFile(
+            path,
+            _winapi.GENERIC_READ | _winapi.GENERIC_WRITE, 0,
+            _winapi.NULL, _winapi.OPEN_EXISTING,
+            _winapi.FILE_FLAG_OVERLAPPED, _winapi.NULL)
+        return PipeConnection(handler)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def wait_ipc(path, proc, timeout=10):
+    """Wait until the ipc server of a just started mpv is connectable
+    :return: connection or None
+    """
+    deadline = time.monotonic() + timeout
+    delay = IPC_RETRY_MIN
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            return connect_ipc(path)
+        except Exception:
+            time.sleep(delay)
+            delay = min(delay * 2, IPC_RETRY_MAX)
+    return None
+
+
+def wait_ipc_event(conn, event, timeout=10):
+    """Read from mpv ipc connection until the event arrived
+    :return: True if the event arrived within timeout
+    """
+    deadline = time.monotonic() + timeout
+    res = b''
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if os.name == 'nt':
+                if not conn.poll(remaining):
+                    return False
+                data = conn.recv_bytes(1048576)
+            else:
+                conn.settimeout(remaining)
+                data = conn.recv(1048576)
+            if data == b'':
+                return False
+            *msgs, res = (res + data).split(b'\n')
+            for msg in msgs:
+                if msg and json.loads(msg).get('event', None) == event:
+                    return True
+    except Exception as e:
+        logger.error("wait mpv event {}: {}".format(event, e))
+        return False
 
 
 class MPVRenderer(Renderer):
@@ -53,30 +367,77 @@ class MPVRenderer(Renderer):
         super(MPVRenderer, self).__init__(lang)
         global _
         _ = lang
-        mpv_rand = random.randint(0, 9999)
-        if os.name == 'nt':
-            self.mpv_sock = Setting.get_base_path(r"\\.\pipe\macast_mpvsocket{}".format(mpv_rand))
-        else:
-            self.mpv_sock = '/tmp/macast_mpvsocket{}'.format(mpv_rand)
+        self.mpv_sock = new_ipc_path()
         self.path = path
         self.proc = None
+        self.spawn_time = None  # when mpv is started, for measuring ready latency
+        self.ready_latency = None  # seconds from mpv start to ipc connected
+        self.reload_downtime = None  # seconds without a player during the last reload
+        self.reload_count = 0
+        self.stderr_lines = collections.deque(maxlen=STDERR_BUFFER_LINES)
+        self.stderr_window = 0  # start of current stderr rate limit window
+        self.stderr_logged = 0
+        self.stderr_suppressed = 0
+        self.standby_proc = None  # started by reload, adopted by MPV_THREAD
+        self.handover = None  # (start, resume playing, shutdown) while reloading
         self.title = Setting.get_friendly_name()
         self.mpv_thread = None
         self.ipc_thread = None
         self.ipc_sock = None
+        self.media_class = ''  # see Renderer.set_media_class
+        self.cache_tuner = CacheTuner()  # see PlayerAdaptiveCache
+        self.session = None  # PlaybackSession of the playing url
+        self.sessions = collections.deque(maxlen=SESSION_HISTORY)
+        self.next_url = None  # preloaded by SetNextAVTransportURI
+        self.next_class = ''  # media class of next_url
+        self.advancing = False  # playing to the next url without gap
         self.pause = False  # changed with pause action
         self.playing = False  # changed with start and stop
         self.ipc_running = False
+        self.ipc_ready = threading.Event()  # set while ipc is connected
         self.ipc_once_connected = False
+        self.mpv_running = False  # mpv is (re)started by MPV_THREAD while True
+        self.spawn_lock = threading.Lock()
+        self.idle_timer = None  # shutdown mpv when idle, see PlayerIdleTimeout
+        self.last_activity = time.monotonic()  # last ensure_mpv, guarded by spawn_lock
+        self.speed = 1.0
+        self.position = 0.0  # playback position (seconds) at position_anchor
+        self.position_anchor = time.monotonic()
         # As long as IPC has been connected, the ipc_once_connected is True
         # When the ipc_once_connected is True, it shows that there is no error
         # in the starting parameters of MPV, and there is no need to wait for
         # one second to restart MPV.
         self.command_lock = threading.Lock()
+        self.request_id = itertools.count(1)
+        self.pending_requests = {}  # request_id -> Future, resolved by the reply of mpv
+        self.requests_lock = threading.Lock()  # guards pending_requests
+        self.observe_handlers = {
+            ObserveProperty.volume.value: self.on_volume_change,
+            ObserveProperty.pause.value: self.on_pause_change,
+            ObserveProperty.mute.value: self.on_mute_change,
+            ObserveProperty.duration.value: self.on_duration_change,
+            ObserveProperty.track_list.value: self.on_track_list_change,
+            ObserveProperty.speed.value: self.on_speed_change,
+            ObserveProperty.sub.value: self.on_sub_change,
+            ObserveProperty.paused_for_cache.value: self.on_paused_for_cache_change,
+            ObserveProperty.cache_speed.value: self.on_cache_speed_change,
+            ObserveProperty.demuxer_cache_duration.value: self.on_demuxer_cache_duration_change,
+            ObserveProperty.frame_drop.value: self.on_frame_drop_change,
+            ObserveProperty.hwdec.value: self.on_hwdec_change,
+        }
+        self.event_handlers = {
+            'end-file': self.on_end_file,
+            'start-file': self.on_start_file,
+            'idle': self.on_idle,
+            'playback-restart': self.on_playback_restart,
+        }
         self.renderer_setting = MPVRendererSetting()
 
     def set_media_stop(self):
+        self.next_url = None
+        self.finish_session('stop')
         self.send_command(['stop'])
+        self.schedule_idle_shutdown()
 
     def set_media_pause(self):
         self.send_command(['set_property', 'pause', True])
@@ -106,9 +467,51 @@ class MPVRenderer(Renderer):
                                   default=SettingProperty.PlayerSize_Normal.value)
         if player_size == SettingProperty.PlayerSize_FullScreen.value:
             options['fullscreen'] = 'yes'
+        options.update(self.get_media_profile(self.media_class))
+        if not self.ensure_mpv():
+            logger.error("mpv is not ready")
+        self.next_url = None
+        self.advancing = False
+        self.new_session(url)
         self.send_command(['loadfile', url, 'replace',
                            ','.join([f'{i}={options[i]}' for i in options])])
 
+    def set_media_class(self, data):
+        """ data : string, 'audio', 'video', 'image' or ''
+        """
+        self.media_class = data
+
+    @staticmethod
+    def get_media_profile(media_class):
+        """Get per-file mpv options of the media class
+        :param media_class: see Renderer.set_media_class
+        :return: dict, empty when profiles are disabled or the class is unknown
+        """
+        if not Setting.get(SettingProperty.PlayerMediaProfile,
+                           SettingProperty.PlayerMediaProfile_Enable.value):
+            return {}
+        return MEDIA_PROFILES.get(media_class, {})
+
+    def set_media_next_url(self, url, media_class=''):
+        """ data : string
+        Append the url to the playlist of mpv, mpv will prefetch it
+        (--prefetch-playlist) and play it without gap.
+        """
+        self.next_url = url if url else None
+        self.next_class = media_class
+        # remove the previous next url, keep the playing one
+        commands = [['playlist-clear']]
+        if self.next_url is not None:
+            commands.append(self.next_url_command())
+        self.send_commands(commands)
+
+    def next_url_command(self):
+        """Command appending next_url to the playlist of mpv
+        """
+        options = self.get_media_profile(self.next_class)
+        return ['loadfile', self.next_url, 'append',
+                ','.join([f'{i}={options[i]}' for i in options])]
+
     def set_media_title(self, data):
         """ data : string
         """
@@ -118,6 +521,8 @@ class MPVRenderer(Renderer):
     def set_media_position(self, data):
         """ data : position, 00:00:00
         """
+        if self.session is not None:
+            self.session.seek_start = time.monotonic()
         self.send_command(['seek', data, 'absolute'])
 
     def set_media_sub_file(self, data):
@@ -139,135 +544,337 @@ class MPVRenderer(Renderer):
     def set_observe(self):
         """Set several property that needed observe
         """
-        self.send_command(
-            ['observe_property', ObserveProperty.volume.value, 'volume'])
-        self.send_command(
-            ['observe_property', ObserveProperty.time_pos.value, 'time-pos'])
-        self.send_command(
-            ['observe_property', ObserveProperty.pause.value, 'pause'])
-        self.send_command(
-            ['observe_property', ObserveProperty.mute.value, 'mute'])
-        self.send_command(
-            ['observe_property', ObserveProperty.duration.value, 'duration'])
-        self.send_command(
-            ['observe_property', ObserveProperty.track_list.value,
-             'track-list'])
-        self.send_command(
-            ['observe_property', ObserveProperty.speed.value,
-             'speed'])
-        self.send_command(
-            ['observe_property', ObserveProperty.sub.value,
-             'sub-visibility'])
+        self.write_ipc([{'command': ['observe_property', prop.value, name]}
+                        for prop, name in OBSERVED_PROPERTIES.items()])
 
         self.set_media_volume(Setting.get(SettingProperty.PlayerDefaultVolume, 100))
+        self.apply_cache_options()
+
+    def on_volume_change(self, data):
+        logger.info("volume: {}".format(data))
+        if data is not None:
+            self.set_state_volume(int(data))
+
+    def anchor_position(self, position):
+        """Set the position clock to a position reported by mpv
+        """
+        self.position = 0.0 if position is None else float(position)
+        self.position_anchor = time.monotonic()
+        self.set_state_position(format_time(self.position))
+
+    def interpolate_position(self):
+        """Estimate current position (seconds) from the position clock
+        """
+        if not self.playing or self.pause:
+            return self.position
+        return self.position + (time.monotonic() - self.position_anchor) * self.speed
+
+    def sync_position(self):
+        """Re-anchor the position clock with an exact query without waiting for reply
+        Used after seek, pause and speed changes.
+        """
+        future = self.send_request(['get_property', 'time-pos'])
+        future.add_done_callback(
+            lambda f: self.anchor_position(None if f.exception() else f.result()))
+
+    def get_media_position(self):
+        position = self.get_property('time-pos', timeout=0.2)
+        if position is None:
+            return format_time(self.interpolate_position())
+        self.anchor_position(position)
+        return format_time(position)
+
+    def on_pause_change(self, data):
+        logger.info("pause: {}".format(data))
+        if self.playing is False:
+            return
+        if data:
+            self.pause = True
+            self.set_state_pause()
+        else:
+            self.pause = False
+            self.set_state_play()
+        self.sync_position()
+
+    def on_mute_change(self, data):
+        self.set_state_mute(data)
+
+    def on_duration_change(self, data):
+        if data is None:
+            duration = '00:00:00'
+        else:
+            duration = format_time(data)
+            cherrypy.engine.publish('mpv_update_duration', duration)
+            logger.info("update duration " + duration)
+            if self.protocol.get_state_transport_state() == 'PLAYING':
+                logger.debug("Living media")
+        self.set_state_duration(duration)
+
+    def on_track_list_change(self, data):
+        if data:
+            tracks = len(data)
+            self.set_state('CurrentTrack', 0 if tracks == 0 else 1)
+            self.set_state('NumberOfTracks', tracks)
+
+    def on_speed_change(self, data):
+        if data is not None:
+            self.speed = float(data)
+            self.set_state_speed(data)
+            self.sync_position()
+
+    def on_sub_change(self, data):
+        if data is not None:
+            self.set_state_subtitle(data)
+
+    def on_paused_for_cache_change(self, data):
+        if data:
+            logger.info("mpv is waiting for cache")
+            cherrypy.engine.publish('renderer_rebuffer')
+            self.tune_cache(self.cache_tuner.on_rebuffer())
+        if data is not None and self.session is not None:
+            self.session.on_paused_for_cache(data)
+
+    def on_cache_speed_change(self, data):
+        if data is not None:
+            self.tune_cache(self.cache_tuner.on_speed(data))
+            if self.session is not None:
+                self.session.on_cache_speed(data)
+
+    def on_demuxer_cache_duration_change(self, data):
+        if data is not None:
+            self.tune_cache(self.cache_tuner.on_duration(data))
+
+    def on_frame_drop_change(self, data):
+        if data is not None and self.session is not None:
+            self.session.dropped_frames = data
+
+    def on_hwdec_change(self, data):
+        if data is not None and self.session is not None:
+            self.session.hwdec = data
+
+    def new_session(self, url):
+        """Start collecting QoS of url, the previous session is finished
+        """
+        self.finish_session('replace')
+        self.session = PlaybackSession(url)
+        self.sessions.append(self.session)
+
+    def finish_session(self, reason):
+        if self.session is not None:
+            self.session.finish(reason)
+            self.session = None
+
+    def get_sessions(self):
+        return [session.to_dict() for session in list(self.sessions)]
+
+    def cache_tunable(self):
+        """The demuxer cache is tuned unless it is fixed by the media profile
+        """
+        if not Setting.get(SettingProperty.PlayerAdaptiveCache,
+                           SettingProperty.PlayerAdaptiveCache_Enable.value):
+            return False
+        return 'demuxer-max-bytes' not in self.get_media_profile(self.media_class)
+
+    def tune_cache(self, level):
+        """Apply the cache level chosen by self.cache_tuner
+        :param level: None means nothing changed
+        """
+        if level is None or not self.cache_tunable():
+            return
+        logger.info("demuxer cache level {}: {}".format(level, self.cache_tuner.get_options()))
+        self.apply_cache_options()
+
+    def apply_cache_options(self):
+        """Set the demuxer cache options of current level to mpv
+        """
+        if self.cache_tunable():
+            options = self.cache_tuner.get_options()
+            self.send_commands([['set_property', name, options[name]] for name in options])
+
+    def get_cache_info(self):
+        info = self.cache_tuner.get_info()
+        info['enabled'] = self.cache_tunable()
+        return info
+
+    def get_metrics(self):
+        return {
+            'ready_latency': self.ready_latency,
+            'reload_downtime': self.reload_downtime,
+            'reload_count': self.reload_count,
+        }
+
+    def on_end_file(self, res):
+        if self.handover is not None:
+            return
+        if res.get('reason', None) == 'eof' and self.next_url is not None:
+            # mpv is going to play the next url in playlist
+            self.new_session(self.next_url)
+            self.next_url = None
+            self.media_class = self.next_class
+            self.advancing = True
+            return
+        if res.get('reason', None) != 'stop':
+            # stopped or replaced sessions are finished by set_media_*
+            self.finish_session(res.get('reason', 'unknown'))
+        cherrypy.engine.publish('renderer_av_stop')
+        self.playing = False
+        self.anchor_position(None)
+        self.schedule_idle_shutdown()
+        if 'reason' not in res:
+            self.set_state_stop()
+        elif res['reason'] == 'error':
+            self.set_state_transport_error()
+        elif res['reason'] == 'eof':
+            # NO_MEDIA_PRESENT
+            self.set_state_eof()
+        else:
+            self.set_state_stop()
+        if res.get('file_error', False):
+            cherrypy.engine.publish('app_notify',
+                                    "File error",
+                                    res['file_error'])
+
+    def on_start_file(self, res):
+        cherrypy.engine.publish('cast_trace', 'start_file')
+        self.playing = True
+        self.cancel_idle_timer()
+        # every stream starts from the default level, mpv defaults are never used
+        self.cache_tuner.reset()
+        self.apply_cache_options()
+        if self.advancing:
+            self.advancing = False
+            self.set_state_next_track()
+            self.set_media_title(self.protocol.get_state_title())
+        # self.set_state_transport('TRANSITIONING')
+        cherrypy.engine.publish('renderer_av_uri', self.protocol.get_state_url())
+
+    def on_idle(self, res):
+        if self.handover is not None:
+            return
+        # video comes to end
+        self.playing = False
+        self.anchor_position(None)
+        self.set_state_stop()
+        self.schedule_idle_shutdown()
+
+    def on_playback_restart(self, res):
+        # video is ready to play
+        cherrypy.engine.publish('cast_trace', 'first_frame')
+        if self.session is not None:
+            self.session.on_playback_restart()
+        if self.pause:
+            self.set_state_pause()
+        else:
+            self.set_state_play()
+        self.sync_position()
 
     def update_state(self, res):
         """Update player state from mpv
+        Replies of requests are matched to their futures by request_id,
+        observed properties and events are dispatched by their handler tables.
         """
         res = json.loads(res)
-        if 'id' in res:
-            if res['id'] == ObserveProperty.volume.value:
-                logger.info(res)
-                if 'data' in res and res['data'] is not None:
-                    self.set_state_volume(int(res['data']))
-            elif res['id'] == ObserveProperty.time_pos.value:
-                if 'data' not in res or res['data'] is None:
-                    position = '00:00:00'
-                else:
-                    sec = int(res['data'])
-                    position = '%d:%02d:%02d' % (sec // 3600, (sec % 3600) // 60, sec % 60)
-                self.set_state_position(position)
-            elif res['id'] == ObserveProperty.pause.value:
-                logger.info(res)
-                if self.playing is False:
-                    return
-                if res['data'] and res['data'] is not None:
-                    self.pause = True
-                    self.set_state_pause()
-                else:
-                    self.pause = False
-                    self.set_state_play()
-            elif res['id'] == ObserveProperty.mute.value:
-                self.set_state_mute(res['data'])
-            elif res['id'] == ObserveProperty.duration.value:
-                if 'data' not in res or res['data'] is None:
-                    duration = '00:00:00'
-                else:
-                    sec = int(res['data'])
-                    duration = '%d:%02d:%02d' % (sec // 3600, (sec % 3600) // 60, sec % 60)
-                    cherrypy.engine.publish('mpv_update_duration', duration)
-                    logger.info("update duration " + duration)
-                    if self.protocol.get_state_transport_state() == 'PLAYING':
-                        logger.debug("Living media")
-                self.set_state_duration(duration)
-            elif res['id'] == ObserveProperty.track_list.value:
-                if res['data'] and res['data'] is not None:
-                    tracks = len(res['data'])
-                    self.set_state('CurrentTrack', 0 if tracks == 0 else 1)
-                    self.set_state('NumberOfTracks', tracks)
-            elif res['id'] == ObserveProperty.speed.value:
-                data = res.get('data', None)
-                if data is not None:
-                    self.set_state_speed(data)
-            elif res['id'] == ObserveProperty.sub.value:
-                data = res.get('data', None)
-                if data is not None:
-                    self.set_state_subtitle(data)
+        if 'request_id' in res:
+            self.resolve_request(res)
+        elif 'id' in res:
+            handler = self.observe_handlers.get(res['id'], None)
+            if handler is not None:
+                handler(res.get('data', None))
         elif 'event' in res:
             logger.info(res)
-            if res['event'] == 'end-file':
-                cherrypy.engine.publish('renderer_av_stop')
-                self.playing = False
-                if 'reason' not in res:
-                    self.set_state_stop()
-                elif res['reason'] == 'error':
-                    self.set_state_transport_error()
-                elif res['reason'] == 'eof':
-                    # NO_MEDIA_PRESENT
-                    self.set_state_eof()
-                else:
-                    self.set_state_stop()
-                if res.get('file_error', False):
-                    cherrypy.engine.publish('app_notify',
-                                            "File error",
-                                            res['file_error'])
-            elif res['event'] == 'start-file':
-                self.playing = True
-                # self.set_state_transport('TRANSITIONING')
-                cherrypy.engine.publish('renderer_av_uri', self.protocol.get_state_url())
-            elif res['event'] == 'seek':
-                pass
-                # self.set_state_transport('TRANSITIONING')
-            elif res['event'] == 'idle':
-                # video comes to end
-                self.playing = False
-                self.set_state_stop()
-            elif res['event'] == 'playback-restart':
-                # video is ready to play
-                if self.pause:
-                    self.set_state_pause()
-                else:
-                    self.set_state_play()
+            handler = self.event_handlers.get(res['event'], None)
+            if handler is not None:
+                handler(res)
         else:
             logger.debug(res)
 
-    def send_command(self, command):
-        """Sending command to mpv
+    def resolve_request(self, res):
+        with self.requests_lock:
+            future = self.pending_requests.pop(res['request_id'], None)
+        if future is None or future.done():
+            return
+        if res.get('error', 'success') == 'success':
+            future.set_result(res.get('data', None))
+        else:
+            future.set_exception(RuntimeError(res['error']))
+
+    def cancel_requests(self):
+        """Fail all the requests still waiting for reply
+        Called when the ipc connection is closed.
         """
-        logger.debug("send command: " + str(command))
-        data = {"command": command}
-        msg = json.dumps(data) + '\n'
+        with self.requests_lock:
+            pending, self.pending_requests = self.pending_requests, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("mpv ipc disconnected"))
+
+    def write_ipc(self, msgs):
+        """Write several messages to mpv in a single write
+        """
+        if not self.ipc_ready.is_set():
+            logger.debug("mpv ipc is not connected, drop: {}".format(msgs))
+            return False
+        data = ''.join([json.dumps(msg) + '\n' for msg in msgs]).encode()
         with self.command_lock:
             try:
                 if os.name == 'nt':
-                    self.ipc_sock.send_bytes(msg.encode())
+                    self.ipc_sock.send_bytes(data)
                 else:
-                    self.ipc_sock.sendall(msg.encode())
+                    self.ipc_sock.sendall(data)
                 return True
             except Exception as e:
                 logger.error('sendCommand: ' + str(e))
                 return False
 
+    def send_command(self, command):
+        """Sending command to mpv
+        """
+        logger.debug("send command: " + str(command))
+        return self.write_ipc([{"command": command}])
+
+    def send_commands(self, commands):
+        """Sending several commands to mpv in one write (pipelined)
+        :param commands: list of mpv commands
+        :return: list of Future, resolved with the data of mpv reply
+        """
+        logger.debug("send commands: " + str(commands))
+        msgs = []
+        futures = []
+        with self.requests_lock:
+            for command in commands:
+                future = Future()
+                future.request_id = next(self.request_id)
+                self.pending_requests[future.request_id] = future
+                msgs.append({"command": command, "request_id": future.request_id})
+                futures.append(future)
+        if not self.write_ipc(msgs):
+            # futures already taken by cancel_requests are failed there
+            with self.requests_lock:
+                failed = [self.pending_requests.pop(future.request_id, None) for future in futures]
+            for future in failed:
+                if future is not None:
+                    future.set_exception(ConnectionError("mpv ipc is not connected"))
+        return futures
+
+    def send_request(self, command):
+        """Sending command to mpv
+        :return: Future, resolved with the data of mpv reply
+        """
+        return self.send_commands([command])[0]
+
+    def get_property(self, name, default=None, timeout=1.0):
+        """Get property of mpv synchronously
+        Never call this method from MPV_IPC_THREAD, which reads the reply.
+        """
+        future = self.send_request(['get_property', name])
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            logger.debug("get_property {}: {}".format(name, e))
+            with self.requests_lock:
+                self.pending_requests.pop(future.request_id, None)
+            return default
+
     def start_ipc(self):
         """Start ipc thread
         Communicating with mpv
@@ -276,28 +883,29 @@ class MPVRenderer(Renderer):
             logger.error("mpv ipc is already runing")
             return
         self.ipc_running = True
+        delay = IPC_RETRY_MIN
         while self.ipc_running and self.running and self.mpv_thread.is_alive():
             try:
-                time.sleep(0.5)
-                logger.error("mpv ipc socket start connect")
-                if os.name == 'nt':
-                    handler = _winapi.CreateFile(
-                        self.mpv_sock,
-                        _winapi.GENERIC_READ | _winapi.GENERIC_WRITE, 0,
-                        _winapi.NULL, _winapi.OPEN_EXISTING,
-                        _winapi.FILE_FLAG_OVERLAPPED, _winapi.NULL)
-                    self.ipc_sock = PipeConnection(handler)
-                else:
-                    self.ipc_sock = socket.socket(socket.AF_UNIX,
-                                                  socket.SOCK_STREAM)
-                    self.ipc_sock.connect(self.mpv_sock)
-                cherrypy.engine.publish('mpvipc_start')
-                cherrypy.engine.publish('renderer_start')
-                self.ipc_once_connected = True
-                self.set_observe()
+                logger.debug("mpv ipc socket start connect")
+                self.ipc_sock = connect_ipc(self.mpv_sock)
             except Exception as e:
-                logger.error("mpv ipc socket reconnecting: {}".format(str(e)))
+                logger.debug("mpv ipc socket reconnecting: {}".format(str(e)))
+                time.sleep(delay)
+                delay = min(delay * 2, IPC_RETRY_MAX)
                 continue
+            delay = IPC_RETRY_MIN
+            if self.spawn_time is not None:
+                self.ready_latency = time.monotonic() - self.spawn_time
+                self.spawn_time = None
+                logger.info("mpv ready in {:.3f}s".format(self.ready_latency))
+                cherrypy.engine.publish('mpv_ready_latency', self.ready_latency)
+            self.ipc_ready.set()
+            cherrypy.engine.publish('mpvipc_start')
+            cherrypy.engine.publish('renderer_start')
+            self.ipc_once_connected = True
+            if self.handover is not None:
+                self.finish_handover()
+            self.set_observe()
             res = b''
             msgs = None
             while self.ipc_running:
@@ -324,96 +932,149 @@ class MPVRenderer(Renderer):
                     logger.error(f"decode error data list: {msgs}")
                 finally:
                     res = b''
+            self.ipc_ready.clear()
             self.ipc_sock.close()
+            self.cancel_requests()
             logger.error("mpv ipc stopped")
 
-    def start_mpv(self):
-        """Start mpv thread
+    def build_params(self, sock):
+        """Build mpv startup parameters from settings
+        :param sock: path of mpv ipc server
         """
-        error_time = 3
-        while self.running and error_time > 0:
-            self.set_state_speed('1')
-            # mpv default params
-            params = [
-                self.path,
-                '--input-ipc-server={}'.format(self.mpv_sock),
-                '--image-display-duration=inf',
-                '--idle=yes',
-                '--no-terminal',
+        # mpv default params
+        params = [
+            self.path,
+            '--input-ipc-server={}'.format(sock),
+            '--image-display-duration=inf',
+            '--idle=yes',
+            # warnings and errors are written to the terminal (stdout) for
+            # get_player_log, without reading keys from stdin or printing the status line
+            '--terminal=yes',
+            '--input-terminal=no',
+            '--quiet',
+            '--msg-level=all=warn',
+            '--on-all-workspaces',
+            '--hwdec=yes',
+            '--save-position-on-quit=yes',
+            '--prefetch-playlist=yes',
+            '--script-opts=osc-timetotal=yes,osc-layout=bottombar,' +
+            'osc-title=${title},osc-showwindowed=yes,' +
+            'osc-seekbarstyle=bar,osc-visibility=auto'
+        ]
+
+        ontop = Setting.get(SettingProperty.PlayerOntop,
+                            default=SettingProperty.PlayerOntop_True.value)
+        if ontop:
+            params.append('--ontop')
+
+        # set player position
+        player_position = Setting.get(SettingProperty.PlayerPosition,
+                                      default=SettingProperty.PlayerPosition_RightTop.value)
+        player_position_data = [[2, 5], [2, 98], [98, 5], [98, 98], [50, 50]]
+        x = player_position_data[player_position][0]
+        y = player_position_data[player_position][1]
+        params.append('--geometry={}%:{}%'.format(x, y))
+
+        # set lua scripts
+        scripts_path = Setting.get_base_path('scripts')
+        if os.path.exists(scripts_path):
+            scripts = os.listdir(scripts_path)
+            scripts = filter(lambda s: s.endswith('.lua'), scripts)
+            for script in scripts:
+                path = os.path.join(scripts_path, script)
+                params.append('--script={}'.format(path))
+
+        # set player size
+        player_size = Setting.get(SettingProperty.PlayerSize,
+                                  default=SettingProperty.PlayerSize_Normal.value)
+        if player_size <= SettingProperty.PlayerSize_Large.value:
+            params.append('--autofit={}%'.format(
+                int(15 - 2.5 * player_size + 7.5 * player_size ** 2)))
+        elif player_size == SettingProperty.PlayerSize_Auto.value:
+            params.append('--autofit-larger=90%')
+        elif player_size == SettingProperty.PlayerSize_FullScreen.value:
+            params.append('--fullscreen')
+
+        # set darwin only options
+        if sys.platform == 'darwin':
+            params += [
+                '--ontop-level=system',
                 '--on-all-workspaces',
-                '--hwdec=yes',
-                '--save-position-on-quit=yes',
-                '--script-opts=osc-timetotal=yes,osc-layout=bottombar,' +
-                'osc-title=${title},osc-showwindowed=yes,' +
-                'osc-seekbarstyle=bar,osc-visibility=auto'
+                '--macos-app-activation-policy=accessory',
             ]
 
-            ontop = Setting.get(SettingProperty.PlayerOntop,
-                                default=SettingProperty.PlayerOntop_True.value)
-            if ontop:
-                params.append('--ontop')
-
-            # set player position
-            player_position = Setting.get(SettingProperty.PlayerPosition,
-                                          default=SettingProperty.PlayerPosition_RightTop.value)
-            player_position_data = [[2, 5], [2, 98], [98, 5], [98, 98], [50, 50]]
-            x = player_position_data[player_position][0]
-            y = player_position_data[player_position][1]
-            params.append('--geometry={}%:{}%'.format(x, y))
-
-            # set lua scripts
-            scripts_path = Setting.get_base_path('scripts')
-            if os.path.exists(scripts_path):
-                scripts = os.listdir(scripts_path)
-                scripts = filter(lambda s: s.endswith('.lua'), scripts)
-                for script in scripts:
-                    path = os.path.join(scripts_path, script)
-                    params.append('--script={}'.format(path))
-
-            # set player size
-            player_size = Setting.get(SettingProperty.PlayerSize,
-                                      default=SettingProperty.PlayerSize_Normal.value)
-            if player_size <= SettingProperty.PlayerSize_Large.value:
-                params.append('--autofit={}%'.format(
-                    int(15 - 2.5 * player_size + 7.5 * player_size ** 2)))
-            elif player_size == SettingProperty.PlayerSize_Auto.value:
-                params.append('--autofit-larger=90%')
-            elif player_size == SettingProperty.PlayerSize_FullScreen.value:
-                params.append('--fullscreen')
-
-            # set darwin only options
-            if sys.platform == 'darwin':
-                params += [
-                    '--ontop-level=system',
-                    '--on-all-workspaces',
-                    '--macos-app-activation-policy=accessory',
-                ]
-
-            # set hardware
-            hw = Setting.get(SettingProperty.PlayerHW,
-                             default=SettingProperty.PlayerHW_Enable.value)
-            if hw == SettingProperty.PlayerHW_Disable.value:
-                params.remove('--hwdec=yes')
-            elif hw == SettingProperty.PlayerHW_Force.value:
-                params.append('--macos-force-dedicated-gpu=yes')
+        # set hardware
+        hw = Setting.get(SettingProperty.PlayerHW,
+                         default=SettingProperty.PlayerHW_Enable.value)
+        if hw == SettingProperty.PlayerHW_Disable.value:
+            params.remove('--hwdec=yes')
+        elif hw == SettingProperty.PlayerHW_Force.value:
+            params.append('--macos-force-dedicated-gpu=yes')
+
+        return params
+
+    def popen_mpv(self, params):
+        return subprocess.Popen(
+            params,
+            # mpv writes log messages to stdout, the status line to stderr
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.PIPE,
+            env=Setting.get_system_env())
 
+    def read_stderr(self, proc):
+        """Read mpv output (stdout and stderr) line by line until mpv exits
+        Only the last lines are kept, so memory stays flat for long sessions.
+        """
+        proc.stdin.close()
+        for line in iter(lambda: proc.stdout.readline(4096), b''):
+            line = line.decode('utf-8', errors='replace').rstrip()
+            self.stderr_lines.append(line)
+            self.log_stderr(line)
+        proc.wait()
+
+    def log_stderr(self, line):
+        now = time.monotonic()
+        if now - self.stderr_window >= 1:
+            if self.stderr_suppressed > 0:
+                logger.info("mpv: {} lines suppressed".format(self.stderr_suppressed))
+            self.stderr_window = now
+            self.stderr_logged = 0
+            self.stderr_suppressed = 0
+        if self.stderr_logged < STDERR_LOG_RATE:
+            self.stderr_logged += 1
+            logger.info("mpv: " + line)
+        else:
+            self.stderr_suppressed += 1
+
+    def get_player_log(self):
+        return list(self.stderr_lines)
+
+    def start_mpv(self):
+        """Start mpv thread
+        """
+        error_time = 3
+        restart_delay = 0.25
+        while self.running and self.mpv_running and error_time > 0:
+            self.set_state_speed('1')
             # start mpv
             logger.info("mpv starting")
             cherrypy.engine.publish('mpv_start')
             try:
-                self.proc = subprocess.Popen(
-                    params,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.PIPE,
-                    stdin=subprocess.PIPE,
-                    env=Setting.get_system_env())
-                self.proc.communicate()
+                if self.standby_proc is not None:
+                    # adopt the mpv started by reload
+                    self.proc, self.standby_proc = self.standby_proc, None
+                else:
+                    self.spawn_time = time.monotonic()
+                    self.proc = self.popen_mpv(self.build_params(self.mpv_sock))
+                self.read_stderr(self.proc)
             except Exception as e:
                 logger.error(e)
             logger.info("mpv stopped")
-            if self.running and not self.ipc_once_connected:
+            if self.running and self.mpv_running and not self.ipc_once_connected:
                 # There should be a problem with the MPV startup parameters
-                time.sleep(1)
+                time.sleep(restart_delay)
+                restart_delay *= 2
                 error_time -= 1
                 logger.error("mpv restarting")
         if error_time <= 0:
@@ -422,21 +1083,21 @@ class MPVRenderer(Renderer):
             logger.error("mpv cannot start")
             threading.Thread(target=lambda: Setting.stop_service(), name="MPV_STOP_SERVICE").start()
 
-    def start(self):
-        """Start mpv and mpv ipc
+    def spawn(self):
+        """Start mpv thread and mpv ipc thread
         """
-        super(MPVRenderer, self).start()
         logger.info("starting mpv and mpv ipc")
+        self.mpv_running = True
         self.mpv_thread = threading.Thread(target=self.start_mpv, name="MPV_THREAD")
         self.mpv_thread.start()
         self.ipc_thread = threading.Thread(target=self.start_ipc, name="MPV_IPC_THREAD")
         self.ipc_thread.start()
 
-    def stop(self):
-        """Stop mpv and mpv ipc
+    def shutdown(self):
+        """Stop mpv thread and mpv ipc thread
         """
-        super(MPVRenderer, self).stop()
         logger.info("stoping mpv and mpv ipc")
+        self.mpv_running = False
         # stop mpv
         self.send_command(['quit'])
         if self.proc is not None:
@@ -445,38 +1106,141 @@ class MPVRenderer(Renderer):
             os.waitpid(-1, 1)
         except Exception as e:
             logger.error(e)
-        self.mpv_thread.join()
+        if self.mpv_thread is not None:
+            self.mpv_thread.join()
         # stop mpv ipc
         self.ipc_running = False
-        self.ipc_thread.join()
+        if self.ipc_thread is not None:
+            self.ipc_thread.join()
+
+    def ensure_mpv(self, timeout=10):
+        """Spawn mpv if it is not running and wait until mpv ipc is connected
+        :return: True if mpv ipc is connected
+        """
+        self.cancel_idle_timer()
+        with self.spawn_lock:
+            # a timer which has already fired sees this and keeps mpv
+            self.last_activity = time.monotonic()
+            if self.running and not self.mpv_running:
+                self.spawn()
+        return self.ipc_ready.wait(timeout)
+
+    def schedule_idle_shutdown(self):
+        """Shutdown mpv after PlayerIdleTimeout seconds of idle
+        mpv will be spawned again by the next SetAVTransportURI
+        """
+        timeout = Setting.get(SettingProperty.PlayerIdleTimeout, 0)
+        if timeout <= 0:
+            return
+        self.cancel_idle_timer()
+        self.idle_timer = threading.Timer(timeout, self.on_idle_timeout, args=(time.monotonic(),))
+        self.idle_timer.daemon = True
+        self.idle_timer.start()
+
+    def cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def on_idle_timeout(self, scheduled):
+        """
+        :param scheduled: when the timer was started, mpv is kept if it was used since
+        """
+        with self.spawn_lock:
+            if self.playing or not self.mpv_running or self.last_activity >= scheduled:
+                return
+            logger.info("mpv is idle, shutting down to free memory")
+            self.shutdown()
+
+    def start(self):
+        """Start mpv and mpv ipc
+        When PlayerIdleTimeout is set, mpv is started on demand.
+        """
+        super(MPVRenderer, self).start()
+        if Setting.get(SettingProperty.PlayerIdleTimeout, 0) > 0:
+            logger.info("mpv will be started on demand")
+            return
+        self.spawn()
+
+    def stop(self):
+        """Stop mpv and mpv ipc
+        """
+        super(MPVRenderer, self).stop()
+        self.cancel_idle_timer()
+        with self.spawn_lock:
+            self.shutdown()
 
     def reload(self):
         """Reload MPV
+        A standby mpv is started with the new settings before the old one quits.
         If the MPV is playing content before reloading the player,
-        then continue playing the previous content after the reload
+        the content is handed over to the standby mpv at the current position,
+        then the standby mpv takes the place of the old one.
         """
-        uri = self.protocol.get_state_url()
+        threading.Thread(target=self.reload_standby, name="MPV_RELOAD_THREAD").start()
 
-        def loadfile():
-            logger.debug("mpv loadfile")
-            protocols = cherrypy.engine.publish('get_protocol')
-            if len(protocols) > 0:
-                protocol = protocols.pop()
-                position = protocol.get_state_position()
-                self.send_command(['loadfile', uri, 'replace', f'start={position}'])
-            else:
-                self.send_command(['loadfile', uri, 'replace'])
-            self.send_command(['set_property', 'title', self.title])
-            cherrypy.engine.unsubscribe('mpvipc_start', loadfile)
+    def reload_standby(self):
+        if not self.running or not self.mpv_running:
+            # mpv is started on demand, new settings take effect on next start
+            return
+        sock = new_ipc_path()
+        try:
+            proc = self.popen_mpv(self.build_params(sock))
+        except Exception as e:
+            logger.error("cannot start standby mpv: {}".format(e))
+            return
+        conn = wait_ipc(sock, proc)
+        if conn is None:
+            logger.error("standby mpv is not ready, keep the old one")
+            proc.terminate()
+            return
 
-        def restart():
-            self.stop()
-            self.start()
+        start = time.monotonic()
+        uri = self.protocol.get_state_url()
+        transport_state = self.protocol.get_state_transport_state()
+        resume = transport_state == 'PLAYING'
+        if uri and transport_state in ['PLAYING', 'PAUSED_PLAYBACK']:
+            position = self.get_property('time-pos', self.interpolate_position())
+            logger.debug("mpv handover {} at {}".format(uri, position))
+            # load paused, the standby mpv is resumed after the old one quits
+            options = {'start': position, 'pause': 'yes'}
+            options.update(self.get_media_profile(self.media_class))
+            msgs = [['loadfile', uri, 'replace',
+                     ','.join([f'{i}={options[i]}' for i in options])],
+                    ['set_property', 'title', self.title]]
+            if self.next_url is not None:
+                # the playlist is not handed over, the next media is queued again
+                msgs.append(self.next_url_command())
+            data = ''.join([json.dumps({"command": msg}) + '\n' for msg in msgs]).encode()
+            if os.name == 'nt':
+                conn.send_bytes(data)
+            else:
+                conn.sendall(data)
+            if not wait_ipc_event(conn, 'playback-restart'):
+                logger.error("standby mpv cannot load {}".format(uri))
+        conn.close()
 
-        if self.protocol.get_state_transport_state() == 'PLAYING':
-            cherrypy.engine.subscribe('mpvipc_start', loadfile)
+        with self.spawn_lock:
+            # events of the quitting mpv are ignored until handover finished
+            self.handover = (start, resume, time.monotonic())
+            self.shutdown()
+            self.mpv_sock = sock
+            self.standby_proc = proc
+            self.spawn()
 
-        threading.Thread(target=restart, args=()).start()
+    def finish_handover(self):
+        """Called by MPV_IPC_THREAD when connected to the standby mpv
+        """
+        start, resume, shutdown = self.handover
+        self.handover = None
+        if resume:
+            self.send_command(['set_property', 'pause', False])
+        now = time.monotonic()
+        self.reload_downtime = now - shutdown
+        self.reload_count += 1
+        logger.info("mpv reloaded, handover: {:.3f}s, downtime: {:.3f}s".format(
+            now - start, self.reload_downtime))
+        cherrypy.engine.publish('mpv_reload_downtime', self.reload_downtime)
 
 
 class SettingProperty(Enum):
@@ -505,6 +1269,19 @@ class SettingProperty(Enum):
 
     PlayerDefaultVolume = 500
 
+    # Seconds to keep an idle mpv alive, 0 means mpv is always running.
+    PlayerIdleTimeout = 600
+
+    # Lightweight player options chosen by the class of media, see MEDIA_PROFILES
+    PlayerMediaProfile = 700
+    PlayerMediaProfile_Disable = 0
+    PlayerMediaProfile_Enable = 1
+
+    # Tune demuxer-max-bytes and cache-secs from the throughput, see CacheTuner
+    PlayerAdaptiveCache = 800
+    PlayerAdaptiveCache_Disable = 0
+    PlayerAdaptiveCache_Enable = 1
+
 
 class MPVRendererSetting(RendererSetting):
     def __init__(self):
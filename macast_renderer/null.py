@@ -0,0 +1,108 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+#
+# <macast.title>Null Renderer</macast.title>
+# <macast.renderer>NullRenderer</macast.renderer>
+# <macast.platform>darwin,linux,win32</macast.platform>
+# <macast.version>0.1</macast.version>
+# <macast.author>xfangfang</macast.author>
+# <macast.desc>Headless renderer for benchmarking, plays nothing.</macast.desc>
+#
+# Null Renderer
+# A headless renderer which plays nothing, media is "played" instantly
+# and the states are reported like a real player.
+# Used for benchmarking the SOAP -> renderer -> event pipeline without a display:
+#   cli(renderer=NullRenderer())
+
+import time
+import logging
+import cherrypy
+
+from macast.renderer import Renderer
+
+logger = logging.getLogger("NullRenderer")
+logger.setLevel(logging.INFO)
+
+
+def format_time(sec):
+    """Convert seconds to string like 0:00:00
+    """
+    sec = int(sec)
+    return '{:02d}:{:02d}:{:02d}'.format(sec // 3600, sec % 3600 // 60, sec % 60)
+
+
+def parse_time(data):
+    """Convert string like 00:00:00 to seconds
+    """
+    sec = 0.0
+    for i in str(data).split(':'):
+        sec = sec * 60 + float(i)
+    return sec
+
+
+class NullRenderer(Renderer):
+    support_platform = {'darwin', 'win32', 'linux'}
+
+    def __init__(self, *args, **kwargs):
+        super(NullRenderer, self).__init__(*args, **kwargs)
+        self.url = None
+        self.pause = False
+        self.speed = 1.0
+        self.position = 0.0  # playback position (seconds) at position_anchor
+        self.position_anchor = time.monotonic()
+
+    def get_position(self):
+        if self.url is None or self.pause:
+            return self.position
+        return self.position + (time.monotonic() - self.position_anchor) * self.speed
+
+    def anchor_position(self, position):
+        self.position = position
+        self.position_anchor = time.monotonic()
+
+    def set_media_stop(self):
+        self.url = None
+        self.anchor_position(0.0)
+        self.set_state_stop()
+        cherrypy.engine.publish('renderer_av_stop')
+
+    def set_media_pause(self):
+        self.anchor_position(self.get_position())
+        self.pause = True
+        self.set_state_pause()
+
+    def set_media_resume(self):
+        self.anchor_position(self.get_position())
+        self.pause = False
+        if self.url is not None:
+            self.set_state_play()
+
+    def set_media_volume(self, data):
+        self.set_state_volume(int(data))
+
+    def set_media_mute(self, data):
+        self.set_state_mute(data)
+
+    def set_media_url(self, url, start="0"):
+        logger.info("play: {}".format(url))
+        self.url = url
+        self.anchor_position(parse_time(start) if start.replace(':', '').isdigit() else 0.0)
+        cherrypy.engine.publish('cast_trace', 'start_file')
+        cherrypy.engine.publish('renderer_av_uri', url)
+        self.set_state_duration('00:00:00')
+        cherrypy.engine.publish('cast_trace', 'first_frame')
+        if self.pause:
+            self.set_state_pause()
+        else:
+            self.set_state_play()
+
+    def set_media_position(self, data):
+        self.anchor_position(parse_time(data))
+        self.set_state_position(format_time(self.position))
+
+    def set_media_speed(self, data):
+        self.anchor_position(self.get_position())
+        self.speed = float(data)
+        self.set_state_speed(data)
+
+    def get_media_position(self):
+        return format_time(self.get_position())
@@ -0,0 +1,16 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+
+import pytest
+
+
+@pytest.fixture
+def setting_dir(tmp_path, monkeypatch):
+    """Keep settings written by tests out of the real config dir
+    """
+    utils = pytest.importorskip('macast.utils')
+    monkeypatch.setattr(utils, 'SETTING_DIR', str(tmp_path))
+    monkeypatch.setattr(utils.Setting, 'setting_path', str(tmp_path / 'macast_setting.json'))
+    monkeypatch.setattr(utils.Setting, 'setting', {})
+    yield tmp_path
+    # pending changes are written here, not by atexit after the paths are restored
+    utils.Setting.flush()
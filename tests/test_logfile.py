@@ -0,0 +1,89 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+
+import pytest
+
+pytest.importorskip('appdirs')
+pytest.importorskip('cherrypy')
+pytest.importorskip('lxml')
+pytest.importorskip('netifaces')
+
+from macast import logfile
+
+
+def write_log(tmp_path, data):
+    path = tmp_path / 'macast.log'
+    path.write_bytes(data)
+    return str(path)
+
+
+def numbered_lines(count):
+    """Lines of 10 bytes each: 'line 0000\\n'
+    """
+    return ''.join('line {:04d}\n'.format(i) for i in range(count)).encode()
+
+
+def test_tail_without_trailing_newline(tmp_path):
+    path = write_log(tmp_path, b'a\nb\nc')
+    res = logfile.read_tail(2, path)
+    assert res['logs'] == 'b\nc'
+    assert (res['offset'], res['end'], res['size']) == (2, 5, 5)
+
+
+def test_tail_with_trailing_newline(tmp_path):
+    path = write_log(tmp_path, b'a\nb\nc\n')
+    res = logfile.read_tail(2, path)
+    assert res['logs'] == 'b\nc\n'
+    assert (res['offset'], res['end']) == (2, 6)
+
+
+def test_tail_of_file_shorter_than_block(tmp_path):
+    data = numbered_lines(3)
+    assert len(data) < logfile.BLOCK_SIZE
+    path = write_log(tmp_path, data)
+    res = logfile.read_tail(10, path)
+    assert res['logs'] == data.decode()
+    assert res['offset'] == 0
+
+
+def test_tail_across_blocks(tmp_path):
+    data = numbered_lines(5000)
+    path = write_log(tmp_path, data)
+    res = logfile.read_tail(1000, path)
+    assert res['logs'] == data[-10000:].decode()
+    assert (res['offset'], res['end']) == (len(data) - 10000, len(data))
+    assert logfile.read_tail(1, path)['logs'] == 'line 4999\n'
+
+
+def test_tail_is_truncated_to_read_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(logfile, 'READ_LIMIT', 95)
+    data = numbered_lines(50)
+    path = write_log(tmp_path, data)
+    res = logfile.read_tail(50, path)
+    assert res['logs'] == data[-95:].decode()
+    assert (res['offset'], res['end']) == (len(data) - 95, len(data))
+
+
+def test_tail_of_missing_file(tmp_path):
+    res = logfile.read_tail(10, str(tmp_path / 'missing.log'))
+    assert res == {'logs': '', 'offset': 0, 'end': 0, 'size': 0}
+
+
+def test_range_with_negative_offset(tmp_path):
+    data = numbered_lines(10)
+    path = write_log(tmp_path, data)
+    res = logfile.read_range(-10, path=path)
+    assert res['logs'] == 'line 0009\n'
+    assert (res['offset'], res['end'], res['size']) == (90, 100, 100)
+    # counting back beyond the start reads from the start
+    assert logfile.read_range(-1000, 10, path)['logs'] == 'line 0000\n'
+
+
+def test_range_limits(tmp_path, monkeypatch):
+    data = numbered_lines(10)
+    path = write_log(tmp_path, data)
+    assert logfile.read_range(20, 10, path)['logs'] == 'line 0002\n'
+    res = logfile.read_range(200, 10, path)
+    assert (res['logs'], res['offset'], res['end']) == ('', 100, 100)
+    monkeypatch.setattr(logfile, 'READ_LIMIT', 15)
+    res = logfile.read_range(0, 1000, path)
+    assert (res['logs'], res['end']) == (data[:15].decode(), 15)
@@ -0,0 +1,90 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+
+import os
+import time
+import threading
+import pytest
+
+pytest.importorskip('appdirs')
+pytest.importorskip('cherrypy')
+pytest.importorskip('lxml')
+pytest.importorskip('netifaces')
+
+from macast.proxy import rewrite_url, media_urls, UrlRegistry, parse_range, BlockCache, SharedFetch
+from macast.protocol import DLNAProtocol
+
+
+@pytest.mark.parametrize('uri', ['', None])
+def test_empty_next_uri(uri):
+    assert rewrite_url(uri) == ''
+    assert DLNAProtocol.media_url(uri) == ''
+    assert uri not in media_urls
+
+
+def test_url_registry_is_bounded():
+    registry = UrlRegistry(max_size=2)
+    for url in ['http://a/1', 'http://a/2', 'http://a/3']:
+        registry.add(url)
+    assert 'http://a/1' not in registry
+    assert 'http://a/2' in registry
+    assert 'http://a/3' in registry
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, (0, 999)),
+    ('bytes=0-', (0, 999)),
+    ('bytes=100-199', (100, 199)),
+    ('bytes=900-2000', (900, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-2000', (0, 999)),
+    ('bytes=1000-', None),
+    ('bytes=500-100', None),
+    ('bytes=-', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+def test_block_cache_evicts_least_recently_used(tmp_path):
+    cache = BlockCache(str(tmp_path / 'cache'), max_size=25)
+    for i in range(2):
+        cache.put(('media', i), bytes(10))
+    # block 0 becomes the most recently used
+    assert cache.get(('media', 0)) == bytes(10)
+    cache.put(('media', 2), bytes(10))
+    assert ('media', 1) not in cache
+    assert not os.path.exists(cache.block_path(('media', 1)))
+    assert cache.get(('media', 0)) == bytes(10)
+    assert cache.get(('media', 2)) == bytes(10)
+    assert cache.size == 20
+
+
+def test_shared_fetch_runs_once_for_concurrent_callers():
+    shared = SharedFetch()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b'data'
+
+    def worker():
+        results.append(shared.get('key', fetch))
+
+    owner = threading.Thread(target=worker)
+    owner.start()
+    assert started.wait(5)
+    joiner = threading.Thread(target=worker)
+    joiner.start()
+    # let the second caller wait on the fetch in flight
+    time.sleep(0.1)
+    release.set()
+    owner.join(5)
+    joiner.join(5)
+    assert len(calls) == 1
+    assert sorted(results, key=lambda i: i[1]) == [(b'data', False), (b'data', True)]
+    assert 'key' not in shared
@@ -0,0 +1,29 @@
+# Copyright (c) 2021 by xfangfang. All Rights Reserved.
+
+import time
+import pytest
+
+pytest.importorskip('appdirs')
+pytest.importorskip('cherrypy')
+pytest.importorskip('lxml')
+pytest.importorskip('netifaces')
+
+from macast.renderer import Renderer
+from macast_renderer.mpv import MPVRenderer
+
+
+def test_default_metrics(setting_dir):
+    assert Renderer().get_metrics() == {}
+
+
+def test_mpv_metrics(setting_dir):
+    renderer = MPVRenderer()
+    assert renderer.get_metrics() == {'ready_latency': None, 'reload_downtime': None, 'reload_count': 0}
+    renderer.ready_latency = 0.25
+    now = time.monotonic()
+    renderer.handover = (now - 1, False, now - 0.5)
+    renderer.finish_handover()
+    metrics = renderer.get_metrics()
+    assert metrics['ready_latency'] == 0.25
+    assert 0.5 <= metrics['reload_downtime'] < 1
+    assert metrics['reload_count'] == 1